@@ -27,6 +27,15 @@ extern "C" {
     unsigned int setGain(qhyccd_handle *, int);
     unsigned int setOffset(qhyccd_handle *, int);
     unsigned int setExposureTime(qhyccd_handle *, int);
+    unsigned int beginLive(qhyccd_handle *);
+    unsigned int startLive(qhyccd_handle *);
+    unsigned int getLiveFrame(qhyccd_handle *, unsigned char *, uint32_t, unsigned int *);
+    unsigned int stopLive(qhyccd_handle *);
+    unsigned int startExposure(qhyccd_handle *);
+    unsigned int exposureRemaining(qhyccd_handle *);
+    unsigned int cancelExposure(qhyccd_handle *);
+    unsigned int readExposure(qhyccd_handle *, unsigned char *, uint32_t, unsigned int *);
+    unsigned int getTemperature(qhyccd_handle *, double *);
 }
 
 
@@ -186,6 +195,83 @@ unsigned int expose(qhyccd_handle *pCamHandle, unsigned char *pImgData, uint32_t
     return 0;
 }
 
+// asynchronous single frame: startExposure returns right away, the caller polls
+// exposureRemaining (or its own clock), may cancelExposure, then calls readExposure
+
+unsigned int startExposure(qhyccd_handle *pCamHandle) {
+    unsigned int retVal = ExpQHYCCDSingleFrame(pCamHandle);
+    if (retVal == QHYCCD_ERROR)
+        return 1;       // error starting the exposure
+    return 0;
+}
+
+unsigned int exposureRemaining(qhyccd_handle *pCamHandle) {
+    // time left in ms as reported by the SDK, 0 once the sensor is being read out
+    return GetQHYCCDExposureRemaining(pCamHandle);
+}
+
+unsigned int cancelExposure(qhyccd_handle *pCamHandle) {
+    unsigned int retVal = CancelQHYCCDExposingAndReadout(pCamHandle);
+    return QHYCCD_SUCCESS == retVal ? 0 : 1;
+}
+
+unsigned int readExposure(qhyccd_handle *pCamHandle, unsigned char *pImgData, uint32_t bpp, unsigned int *expRegion) {
+    // blocks until the readout is done
+    unsigned int channels = 1;
+    unsigned int retVal = GetQHYCCDSingleFrame(pCamHandle, &expRegion[2], &expRegion[3], &bpp, &channels, pImgData);
+    if (QHYCCD_SUCCESS != retVal)
+        return 2;       // error getting the camera's single frame
+
+    return 0;
+}
+
+unsigned int beginLive(qhyccd_handle *pCamHandle) {
+    // live mode needs the camera to be re-initialized in stream mode 1,
+    // this resets the exposure parameters, they have to be set again afterward
+    unsigned int retVal = SetQHYCCDStreamMode(pCamHandle, 1);
+    if (QHYCCD_SUCCESS != retVal)
+        return 1;       // error setting the camera's stream mode
+
+    retVal = InitQHYCCD(pCamHandle);
+    if (QHYCCD_SUCCESS != retVal)
+        return 2;       // error initializing the camera
+
+    return 0;
+}
+
+unsigned int startLive(qhyccd_handle *pCamHandle) {
+    // called once the exposure parameters are set
+    unsigned int retVal = BeginQHYCCDLive(pCamHandle);
+    return QHYCCD_SUCCESS == retVal ? 0 : 1;
+}
+
+unsigned int getLiveFrame(qhyccd_handle *pCamHandle, unsigned char *pImgData, uint32_t bpp, unsigned int *expRegion) {
+    unsigned int channels = 1;
+    unsigned int retVal = GetQHYCCDLiveFrame(pCamHandle, &expRegion[2], &expRegion[3], &bpp, &channels, pImgData);
+    if (QHYCCD_SUCCESS != retVal)
+        return 1;       // no new frame yet
+
+    return 0;
+}
+
+unsigned int stopLive(qhyccd_handle *pCamHandle) {
+    unsigned int retVal = StopQHYCCDLive(pCamHandle);
+    if (QHYCCD_SUCCESS != retVal)
+        return 1;       // error stopping the live stream
+
+    // back to single frame mode
+    return initCamera(pCamHandle) ? 2 : 0;
+}
+
+unsigned int getTemperature(qhyccd_handle *pCamHandle, double *temperature) {
+    // sensor temperature in degrees C
+    unsigned int retVal = IsQHYCCDControlAvailable(pCamHandle, CONTROL_CURTEMP);
+    if (retVal != QHYCCD_SUCCESS)
+        return 1;       // the camera has no temperature sensor
+    *temperature = GetQHYCCDParam(pCamHandle, CONTROL_CURTEMP);
+    return 0;
+}
+
 
 void disconnectCamera(qhyccd_handle *pCamHandle) {
     CloseQHYCCD(pCamHandle);
@@ -15,28 +15,13 @@ function fetchAndDisplayImages() {
 //     window.location.href = '/download';
 // }
 
-function onDownloadClicked(filename) {
-    alert("requesting download");
-    fetch('/download', {
-        method: 'GET'
-    })
-    .then(response => response.blob())
-    .then(blob => {
-        alert("Download will start shortly");
-        const url = window.URL.createObjectURL(blob);
-        const a = document.createElement('a');
-        a.style.display = 'none';
-        a.href = url;
-        a.download = "images.bin";
-        document.body.appendChild(a);
-        a.click();
-        window.URL.revokeObjectURL(url);
-        document.body.removeChild(a);
-    })
-    .catch(error => console.error('Error downloading files:', error));
+function onDownloadClicked() {
+    // let the browser stream the archive to disk instead of buffering it in a blob,
+    // this also lets the browser resume an interrupted download
+    alert("Download will start shortly");
+    window.location.href = '/download';
 }
 
-
 // function onDownloadClicked() {
 //     fetch('/download', {
 //         method: 'GET'
@@ -100,7 +85,8 @@ function displayImages() {
             imageDiv.className = 'image';
             imageDiv.innerHTML = `
                 <div>
-                    <img src='/shared/img/${images[index][0]}.png' onclick="toggleFullscreen(this)" alt="">
+                    <img src='/thumbnail/medium/${images[index][0]}' data-full='/shared/img/${images[index][5]}'
+                         onclick="toggleFullscreen(this)" alt="" loading="lazy">
                     <div>
                         <h2 style="margin: 0;">${images[index][1]}</h2>
                         <div style="margin-top: auto;">
@@ -240,11 +226,19 @@ function isNumber(value) {
 
 function toggleFullscreen(img) {
     if (!document.fullscreenElement) {
+        // the gallery only shows thumbnails, load the full image when it is enlarged
+        if (img.dataset.full && img.src !== img.dataset.full) {
+            img.dataset.thumbnail = img.src;
+            img.src = img.dataset.full;
+        }
         img.requestFullscreen().catch(err => {
             alert(`Error attempting to enable full-screen mode: ${err.message} (${err.name})`);
         });
     } else {
-        document.exitFullscreen().then(r => {});
+        document.exitFullscreen().then(r => {
+            if (img.dataset.thumbnail)
+                img.src = img.dataset.thumbnail;
+        });
     }
 }
 
@@ -348,6 +342,23 @@ function deletePresent(){
         .catch(error => console.error('Error:', error));
 }
 
+function tagPresent(){
+    const tagName = prompt("Tag the displayed images with:");
+    if (!tagName)
+        return;
+    fetch('/tag_images', {
+        method: 'POST',
+        headers: {'Content-Type': 'application/json'},
+        body: JSON.stringify({tag: tagName})
+    })
+        .then(response => response.json())
+        .then(data => {
+            alert(data.message);
+            update_tags();
+        })
+        .catch(error => console.error('Error:', error));
+}
+
 function update_tags() {
     fetch('/get_tags')
         .then(response => response.json())
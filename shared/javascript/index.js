@@ -133,7 +133,12 @@ function startScheduler() {
         exposure: exposureTime,
         interval: intervalTime,
         gain: gain,
-        offset: offset
+        offset: offset,
+        live: document.getElementById('liveMode').checked ? 1 : 0,
+        compression: document.getElementById('compression').value,
+        calibrate: document.getElementById('calibrate').checked ? 1 : 0,
+        hot_pixels: document.getElementById('hotPixels').checked ? 1 : 0,
+        meteors: document.getElementById('meteors').checked ? 1 : 0
     };
 
     fetch(`/start_scheduler/${count}`, {
@@ -171,6 +176,11 @@ function getSettings() {
             document.getElementById('intervalTime').placeholder = data.interval;
             document.getElementById('gain').placeholder = data.gain;
             document.getElementById('offset').placeholder = data.offset;
+            document.getElementById('liveMode').checked = data.live === 1;
+            document.getElementById('compression').value = data.compression || 'none';
+            document.getElementById('calibrate').checked = data.calibrate === 1;
+            document.getElementById('hotPixels').checked = data.hot_pixels === 1;
+            document.getElementById('meteors').checked = data.meteors === 1;
         });
 }
 
@@ -187,17 +197,11 @@ function getSchedulerStatus() {
     fetch('/get_scheduler_status')
         .then(response => response.json())
         .then(data => {
+            showSchedulerStatus(data);
             if (data.running === "r") {
-                document.getElementById("exposure").innerText = "Cancel Exposure";
                 fetch('/get_progress')
                     .then(response => response.json())
-                    .then(data => {
-                        document.getElementById('expProgress').innerText = data.eta;
-                    });
-            } else {
-                document.getElementById("exposure").innerText = "Start Exposure";
-                document.getElementById('expProgress').innerText = '';
-                exposing = false;
+                    .then(data => showProgress(data));
             }
         });
 }
@@ -211,26 +215,68 @@ function getPreviewImage() {
 
                 return;
             }
-            if (current_image === data.img_name) {
-                return;
-            }
-            document.getElementById('previewImage').src = `/shared/img/${data.img_name}`;
-            current_image = data.img_name;
+            showPreviewImage(data);
         });
 }
 
-function repeatGetPreviewImage() {
-    if (exposing)
-        getPreviewImage();
-}
-
 function main(){
     getSettings();
     getPreviewImage();
     restoreCurrentTag();
 }
 
+function showProgress(data) {
+    let progress = data.eta;
+    if (data.exposure && data.exposure.duration >= 1)
+        progress += ` (exposing ${data.exposure.elapsed}/${data.exposure.duration}s)`;
+    if (data.queue)
+        progress += ` (writing ${data.queue.depth}/${data.queue.max_depth})`;
+    document.getElementById('expProgress').innerText = progress;
+}
+
+function showSchedulerStatus(data) {
+    if (data.running === "r") {
+        document.getElementById("exposure").innerText = "Cancel Exposure";
+    } else {
+        document.getElementById("exposure").innerText = "Start Exposure";
+        document.getElementById('expProgress').innerText = '';
+        exposing = false;
+    }
+}
+
+function showPreviewImage(data) {
+    if (current_image === data.img_name)
+        return;
+    if (data.seq !== undefined)
+        // the newest frame is kept in memory by the server as a small jpeg
+        document.getElementById('previewImage').src = `/preview?seq=${data.seq}`;
+    else
+        document.getElementById('previewImage').src = `/shared/img/${data.img_name}`;
+    current_image = data.img_name;
+}
+
+function subscribeEvents() {
+    // the server pushes the state when it changes instead of being polled every second,
+    // EventSource reconnects by itself and the server replays the latest state on connect
+    const source = new EventSource('/events');
+    source.addEventListener('scheduler', event => showSchedulerStatus(JSON.parse(event.data)));
+    source.addEventListener('progress', event => {
+        if (document.getElementById("exposure").innerText === "Cancel Exposure")
+            showProgress(JSON.parse(event.data));
+    });
+    source.addEventListener('frame', event => showPreviewImage(JSON.parse(event.data)));
+    source.addEventListener('meteor', event => {
+        const data = JSON.parse(event.data);
+        document.getElementById('meteorInfo').innerText = `Last meteor: ${data.name} (${data.detections.length})`;
+    });
+    source.addEventListener('resources', event => {
+        const data = JSON.parse(event.data);
+        document.getElementById("diskInfo").innerText = data.disk;
+        document.getElementById('memoryInfo').innerText = data.memory;
+    });
+}
+
 main();
-setInterval(getSchedulerStatus, 1000);
-setInterval(repeatGetPreviewImage, 1000);
-setInterval(updateDiskMemory, 1000);
+getSchedulerStatus();
+updateDiskMemory();
+subscribeEvents();
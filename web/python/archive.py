@@ -0,0 +1,103 @@
+import os
+import hashlib
+import tarfile
+from typing import Iterator, Optional
+
+CHUNK_SIZE = 1024 * 1024
+BLOCK_SIZE = tarfile.BLOCKSIZE
+
+
+class TarStream:
+    """
+    Uncompressed TAR archive streamed straight from the image files.
+
+    The layout of the archive (headers, file data, padding) is computed up front
+    from ``os.stat``, so the total size is known before the first byte is sent and
+    any byte range of it can be produced without building the archive in memory.
+    Names longer than 100 bytes and files larger than 8 GB get PAX headers.
+    """
+
+    def __init__(self, files: list[tuple[str, str]]) -> None:
+        """``files`` is a list of ``(name in the archive, path on disk)``."""
+        self.segments: list[tuple[int, int, object]] = []     # (offset, length, bytes or file path)
+        self.size = 0
+        digest = hashlib.sha1()
+        for arcname, path in files:
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                print(f"File not found: {path}")
+                continue
+            info = tarfile.TarInfo(arcname)
+            info.size = stat.st_size
+            info.mtime = int(stat.st_mtime)
+            info.mode = 0o644
+            self._add(info.tobuf(format=tarfile.PAX_FORMAT, encoding="utf-8"))
+            self._add(path, stat.st_size)
+            if padding := -stat.st_size % BLOCK_SIZE:
+                self._add(bytes(padding))
+            digest.update(f"{arcname}\0{stat.st_size}\0{stat.st_mtime_ns}\0".encode())
+        self._add(bytes(2 * BLOCK_SIZE))   # end-of-archive marker
+        self.etag = digest.hexdigest()
+
+    def _add(self, data, length: Optional[int] = None) -> None:
+        length = len(data) if length is None else length
+        self.segments.append((self.size, length, data))
+        self.size += length
+
+    def iter_range(self, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        """Yield the bytes ``start`` to ``end`` (inclusive) of the archive."""
+        end = self.size - 1 if end is None else min(end, self.size - 1)
+        for offset, length, data in self.segments:
+            if offset + length <= start:
+                continue
+            if offset > end:
+                break
+            lo = max(start - offset, 0)
+            hi = min(end - offset + 1, length)
+            if isinstance(data, bytes):
+                yield data[lo:hi]
+            else:
+                yield from self._read_file(data, lo, hi)
+
+    @staticmethod
+    def _read_file(path: str, lo: int, hi: int) -> Iterator[bytes]:
+        remaining = hi - lo
+        try:
+            with open(path, "rb") as f:
+                f.seek(lo)
+                while remaining > 0:
+                    chunk = f.read(min(CHUNK_SIZE, remaining))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    yield chunk
+        except FileNotFoundError:
+            print(f"File not found: {path}")
+        # the file shrank or vanished after the headers were computed, keep the declared size
+        while remaining > 0:
+            pad = min(CHUNK_SIZE, remaining)
+            remaining -= pad
+            yield bytes(pad)
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[tuple[int, int]]:
+    """Parse a single ``bytes=`` range. Returns None for a missing or unsupported header."""
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    first, _, last = header[len("bytes="):].strip().partition("-")
+    try:
+        if first == "":
+            # suffix range: the last N bytes
+            length = int(last)
+            if length <= 0:
+                return None
+            return max(size - length, 0), size - 1
+        start = int(first)
+        end = int(last) if last else max(size - 1, start)
+    except ValueError:
+        return None
+    if start > end:
+        return None
+    # a start past the end is returned as is, the caller answers it with 416
+    return start, max(min(end, size - 1), start)
@@ -0,0 +1,242 @@
+"""
+Headless benchmark of the capture pipeline (expose -> FITS -> PNG) on the emulated camera.
+
+    python3 benchmark.py --frames 20 --output bench.json
+    python3 benchmark.py --outputs fits --fits-compressions none rice hcompress --exposure 2000000
+
+Every combination of resolution, bit depth, bin mode and output format is run
+for a number of frames. The report has the p50/p95/p99 latency of every stage,
+the sustained frames per second, the peak RSS and the bytes written per frame,
+and ``--output`` saves it as JSON to compare against a previous run.
+``--preview-formats legacy`` times the former min/max normalized PNG preview.
+FITS files are also read back after the run, and the compression ratio against
+the raw frame size is reported; use a long ``--exposure`` for sky-like frames.
+``--hot-pixels`` adds the hot pixel correction (with a map detected in a dark
+frame) and the rolling detector to every frame, and reports their share of the
+frame time. ``--meteors`` runs the meteor detector on every frame, with a streak
+in one emulated frame out of ten, and reports how many were found.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import itertools
+from threading import Thread, Event
+
+import cv2
+import numpy as np
+import psutil
+from astropy.io import fits
+
+from camera import Camera, FITS_COMPRESSION
+from emulator import SkyEmulator
+from stretch import PreviewEncoder
+from hotpixels import HotPixels
+from meteors import MeteorDetector
+
+STAGES = ("expose", "hot_pixel_detect", "hot_pixels", "meteors", "fits", "preview", "fits_read")
+
+
+def legacy_preview(array: np.ndarray, filename: str) -> str:
+    # the preview written before the percentile stretch: half size, min/max normalized PNG
+    height, width = array.shape
+    resized_image = cv2.resize(array, (width // 2, height // 2), interpolation=cv2.INTER_AREA)
+    cv2.imwrite(f"{filename}.png", np.uint8(cv2.normalize(resized_image, None, 0, 255, cv2.NORM_MINMAX)))
+    return f"{filename}.png"
+
+
+def percentiles(samples: list[float]) -> dict:
+    if not samples:
+        return {}
+    p50, p95, p99 = np.percentile(np.array(samples) * 1000, [50, 95, 99])
+    return {"p50_ms": round(p50, 3), "p95_ms": round(p95, 3), "p99_ms": round(p99, 3)}
+
+
+class RssSampler:
+    """Peak resident memory of this process while a configuration runs."""
+
+    def __init__(self, interval: float = 0.01) -> None:
+        self.interval = interval
+        self.process = psutil.Process()
+        self.peak = 0
+        self._stop = Event()
+        self._thread = Thread(target=self._run, daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self.process.memory_info().rss)
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = self.process.memory_info().rss
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        self._thread.join()
+
+
+def run_config(resolution: tuple[int, int], bbp: int, bin_mode: tuple[int, int], output: str, preview_format: str,
+               compression: str, frames: int, exposure: int, readout: bool, use_pool: bool, out_dir: str,
+               hot_pixels: bool = False, meteors: bool = False) -> dict:
+    emulator = SkyEmulator(resolution, usb_rate=200e6 if readout else float("inf"),
+                           readout_overhead=0.005 if readout else 0.0, meteor_rate=0.1 if meteors else 0.0)
+    cam = Camera(out_dir, emulate=True, use_pool=use_pool, emulator=emulator)
+    cam.resolution = resolution
+    if preview_format == "legacy":
+        write_preview = legacy_preview
+    else:
+        write_preview = PreviewEncoder(preview_format).write
+    hot_map = None
+    if hot_pixels:
+        hot_map = HotPixels(os.path.join(out_dir, "hot_pixels.npz"))
+        emulator.covered = True
+        dark, _ = cam.expose(exposure, bin_mode=bin_mode, bbp=bbp)
+        emulator.covered = False
+        hot_map.from_dark(dark.copy())
+        cam.release(dark)
+        # a second instance only runs the rolling detector, the dark map would make it skip the frames
+        rolling = HotPixels(os.path.join(out_dir, "rolling.npz"))
+    detector = MeteorDetector() if meteors else None
+    streaks, found = 0, 0
+
+    info = {"exposure": f"{exposure / 1e6:.1f}", "gain": 100, "offset": 10, "timestamp": "", "tag": "benchmark"}
+    timings = {stage: [] for stage in STAGES}
+    bytes_written = 0
+    fits_bytes, raw_bytes = 0, 0
+
+    with RssSampler() as rss:
+        wall_start = time.perf_counter()
+        for i in range(frames):
+            filename = os.path.join(out_dir, f"frame_{i:05d}")
+            info["timestamp"] = f"frame_{i:05d}"
+
+            start = time.perf_counter()
+            array, _ = cam.expose(exposure, bin_mode=bin_mode, bbp=bbp)
+            timings["expose"].append(time.perf_counter() - start)
+
+            if hot_map is not None:
+                start = time.perf_counter()
+                rolling.observe(array)
+                timings["hot_pixel_detect"].append(time.perf_counter() - start)
+                start = time.perf_counter()
+                info["hot_pixels"] = hot_map.correct(array)
+                timings["hot_pixels"].append(time.perf_counter() - start)
+            if detector is not None:
+                streaks += len(emulator.meteors)
+                start = time.perf_counter()
+                found += len(detector.detect(array))
+                timings["meteors"].append(time.perf_counter() - start)
+            if output in ("fits", "both"):
+                start = time.perf_counter()
+                cam.array_to_fits(array, filename, info, compression)
+                timings["fits"].append(time.perf_counter() - start)
+                fits_bytes += os.path.getsize(f"{filename}.fits")
+                raw_bytes += array.nbytes
+            if output in ("preview", "both"):
+                start = time.perf_counter()
+                preview_path = write_preview(array, filename)
+                timings["preview"].append(time.perf_counter() - start)
+                bytes_written += os.path.getsize(preview_path)
+            cam.release(array)
+        wall_time = time.perf_counter() - wall_start
+    bytes_written += fits_bytes
+
+    # reading back is not part of the capture, it is what the gallery and the indexer pay
+    for i in range(frames if output in ("fits", "both") else 0):
+        start = time.perf_counter()
+        with fits.open(os.path.join(out_dir, f"frame_{i:05d}.fits")) as hdul:
+            Camera.image_hdu(hdul).data.sum()
+        timings["fits_read"].append(time.perf_counter() - start)
+
+    hot_pixel_seconds = sum(timings["hot_pixels"]) + sum(timings["hot_pixel_detect"])
+    return {
+        "resolution": list(resolution),
+        "bbp": bbp,
+        "bin_mode": list(bin_mode),
+        "output": output,
+        "preview_format": preview_format,
+        "fits_compression": compression,
+        "pool": use_pool,
+        "frames": frames,
+        "fps": round(frames / wall_time, 3),
+        "stages": {stage: percentiles(samples) for stage, samples in timings.items() if samples},
+        "peak_rss_mb": round(rss.peak / 1024 ** 2, 1),
+        "bytes_per_frame": bytes_written // frames,
+        "fits_ratio": round(raw_bytes / fits_bytes, 3) if fits_bytes else None,
+        "hot_pixels": len(hot_map.map) if hot_map is not None else None,
+        # of the wall time per frame, the correction and the detector together
+        "hot_pixel_overhead_pct": round(100 * hot_pixel_seconds / wall_time, 3) if hot_map is not None else None,
+        "meteors": {"emulated": streaks, "detected": found} if detector is not None else None,
+    }
+
+
+def parse_pair(text: str) -> tuple[int, int]:
+    first, second = text.lower().split("x")
+    return int(first), int(second)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the capture pipeline on the emulated camera")
+    parser.add_argument("--frames", type=int, default=10, help="frames per configuration")
+    parser.add_argument("--exposure", type=int, default=1000, help="exposure time in us")
+    parser.add_argument("--resolutions", nargs="+", default=["1920x1080", "3840x2160"])
+    parser.add_argument("--bit-depths", nargs="+", type=int, default=[16, 8])
+    parser.add_argument("--bin-modes", nargs="+", default=["1x1", "2x2"])
+    parser.add_argument("--outputs", nargs="+", default=["both"], choices=["fits", "preview", "both"])
+    parser.add_argument("--preview-formats", nargs="+", default=["jpg"],
+                        choices=[*PreviewEncoder.FORMATS, "legacy"])
+    parser.add_argument("--fits-compressions", nargs="+", default=["none"], choices=list(FITS_COMPRESSION))
+    parser.add_argument("--no-readout", action="store_true", help="do not simulate the USB readout time")
+    parser.add_argument("--no-pool", action="store_true", help="allocate a new frame for every exposure")
+    parser.add_argument("--hot-pixels", action="store_true", help="detect and correct the hot pixels of every frame")
+    parser.add_argument("--meteors", action="store_true", help="run the meteor detector on every frame")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    results = []
+    matrix = itertools.product(args.resolutions, args.bit_depths, args.bin_modes, args.outputs, args.preview_formats,
+                               args.fits_compressions)
+    for resolution, bbp, bin_mode, output, preview_format, compression in matrix:
+        out_dir = tempfile.mkdtemp(prefix="allsky_bench_")
+        try:
+            result = run_config(parse_pair(resolution), bbp, parse_pair(bin_mode), output, preview_format,
+                                compression, args.frames, args.exposure, not args.no_readout, not args.no_pool, out_dir,
+                                args.hot_pixels, args.meteors)
+        finally:
+            shutil.rmtree(out_dir, ignore_errors=True)
+        results.append(result)
+
+        stages = "  ".join(
+            f"{stage} {values['p50_ms']:.1f}/{values['p95_ms']:.1f}/{values['p99_ms']:.1f}ms"
+            for stage, values in result["stages"].items()
+        )
+        ratio = f"  fits x{result['fits_ratio']}" if result["fits_ratio"] else ""
+        if result["hot_pixels"] is not None:
+            ratio += f"  {result['hot_pixels']} hot pixels, {result['hot_pixel_overhead_pct']}% of the frame time"
+        if result["meteors"] is not None:
+            ratio += f"  meteors {result['meteors']['detected']}/{result['meteors']['emulated']}"
+        print(f"{resolution:>10} {bbp:>2}bit bin {bin_mode} {output:<7} {preview_format:<6} {compression:<9}  "
+              f"{result['fps']:7.2f} fps  "
+              f"{stages}  rss {result['peak_rss_mb']} MB  {result['bytes_per_frame'] / 1024 ** 2:.2f} MB/frame{ratio}")
+
+    if args.output:
+        report = {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "machine": platform.machine(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "results": results,
+        }
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,250 @@
+"""
+Library of master calibration frames (bias, dark, flat) and their application to new frames.
+
+A series is captured frame by frame into a memory-mapped stack on disk, and its
+median is combined a band of rows at a time, so building a master never needs the
+whole series in memory. Masters are saved as float32 FITS files named after their
+key ``(kind, exposure, gain, offset, bin, temperature)`` in the library directory.
+Applying them is a subtract and a multiply on the frame, done in place.
+"""
+from __future__ import annotations
+
+import os
+import re
+import time
+from collections import OrderedDict
+from threading import Lock, local
+from typing import NamedTuple, Optional
+
+import lazy
+
+np = lazy.load("numpy")
+fits = lazy.load("astropy.io.fits")
+
+KINDS = ("bias", "dark", "flat")
+BIAS_EXPOSURE = 30              # us, about the shortest exposure of the camera
+PEDESTAL = 100                  # ADU added after the dark subtraction, so that the noise is not clipped at 0
+TEMPERATURE_TOLERANCE = 2.0     # degrees C between a frame and the dark that calibrates it
+CHUNK_BYTES = 64 * 1024 ** 2    # of the series loaded at once by the median combine
+FLAT_FLOOR = 0.1                # flat pixels darker than this (relative to the mean) are left uncorrected
+
+FILENAME = re.compile(r"(?P<kind>bias|dark|flat)_e(?P<exposure>\d+)_g(?P<gain>\d+)_o(?P<offset>\d+)"
+                      r"_b(?P<bx>\d+)x(?P<by>\d+)_t(?P<temperature>[+-]\d+|na)\.fits$")
+
+
+class MasterKey(NamedTuple):
+    kind: str
+    exposure: int                   # us, 0 for bias and flat masters (they match any exposure)
+    gain: int
+    offset: int
+    bin: tuple[int, int]
+    temperature: Optional[int]      # degrees C, None if the camera has no sensor (or for flats)
+
+    @classmethod
+    def of(cls, kind: str, exposure: int, gain: int, offset: int, bin_mode: tuple[int, int],
+           temperature: Optional[float]) -> "MasterKey":
+        if kind not in KINDS:
+            raise ValueError(f"Unknown calibration frame {kind}")
+        return cls(kind, exposure if kind == "dark" else 0, gain, offset, tuple(bin_mode),
+                   round(temperature) if temperature is not None and kind != "flat" else None)
+
+    def filename(self) -> str:
+        temperature = "na" if self.temperature is None else f"{self.temperature:+d}"
+        return (f"{self.kind}_e{self.exposure}_g{self.gain}_o{self.offset}"
+                f"_b{self.bin[0]}x{self.bin[1]}_t{temperature}.fits")
+
+    def to_dict(self) -> dict:
+        return {**self._asdict(), "bin": f"{self.bin[0]}x{self.bin[1]}", "name": self.filename()}
+
+
+class Series:
+    """
+    Frames of one calibration series, written to a memory-mapped stack as they are captured.
+
+    Flats are scaled by the median of each frame before they are combined, so a sky or a
+    panel that brightens during the series does not bias the master.
+    """
+
+    def __init__(self, key: MasterKey, count: int, shape: tuple[int, int], work_dir: str) -> None:
+        self.key = key
+        self.count = count
+        self.shape = shape
+        self.path = os.path.join(work_dir, f"{key.filename()}.{os.getpid()}.stack.npy")
+        self.stack = np.lib.format.open_memmap(self.path, mode="w+", dtype=np.uint16, shape=(count, *shape))
+        self.scales = np.ones(count, dtype=np.float32)
+        self.temperatures: list[float] = []
+        self.frames = 0
+
+    def add(self, frame: np.ndarray, temperature: Optional[float] = None) -> None:
+        if frame.shape != self.shape:
+            raise ValueError(f"Frame of shape {frame.shape} in a series of {self.shape}")
+        self.stack[self.frames] = frame
+        if self.key.kind == "flat":
+            self.scales[self.frames] = max(float(np.median(frame[::8, ::8])), 1.0)
+        if temperature is not None:
+            self.temperatures.append(temperature)
+        self.frames += 1
+
+    def combine(self, chunk_bytes: int = CHUNK_BYTES) -> np.ndarray:
+        """Median of the frames added so far, as float32."""
+        if self.frames == 0:
+            raise ValueError("No frame to combine")
+        height, width = self.shape
+        rows = max(1, chunk_bytes // (self.frames * width * 4))
+        master = np.empty(self.shape, dtype=np.float32)
+        for row in range(0, height, rows):
+            band = self.stack[:self.frames, row:row + rows].astype(np.float32)
+            if self.key.kind == "flat":
+                band /= self.scales[:self.frames, None, None]
+            np.median(band, axis=0, out=master[row:row + rows])
+        return master
+
+    def close(self) -> None:
+        self.stack = None       # unmaps the stack
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class CalibrationLibrary:
+    """
+    Master frames on disk, an LRU cache of the ones in use, and the calibration of new frames.
+
+    A frame is calibrated with the dark of its exposure, gain, offset and bin mode at the
+    nearest temperature (or the bias when there is no such dark) and the flat of its gain,
+    offset and bin mode: ``(frame - dark) / flat + PEDESTAL``.
+    """
+
+    def __init__(self, directory: str, cache_size: int = 4) -> None:
+        self.directory = directory
+        self.cache_size = cache_size
+        os.makedirs(directory, exist_ok=True)
+        self._lock = Lock()
+        self._masters: dict[MasterKey, str] = {}
+        self._cache: OrderedDict[MasterKey, np.ndarray] = OrderedDict()
+        self._local = local()       # float32 scratch frame of each writer thread
+        for filename in os.listdir(directory):
+            if match := FILENAME.match(filename):
+                self._masters[self._key_of(match)] = os.path.join(directory, filename)
+
+    @staticmethod
+    def _key_of(match: re.Match) -> MasterKey:
+        temperature = match["temperature"]
+        return MasterKey(match["kind"], int(match["exposure"]), int(match["gain"]), int(match["offset"]),
+                         (int(match["bx"]), int(match["by"])), None if temperature == "na" else int(temperature))
+
+    def masters(self) -> list[dict]:
+        with self._lock:
+            return [key.to_dict() for key in sorted(self._masters, key=lambda k: (k.kind, k.exposure, k.gain))]
+
+    def series(self, kind: str, count: int, shape: tuple[int, int], exposure: int, gain: int, offset: int,
+               bin_mode: tuple[int, int] = (1, 1), temperature: Optional[float] = None) -> Series:
+        return Series(MasterKey.of(kind, exposure, gain, offset, bin_mode, temperature), count, shape, self.directory)
+
+    def build(self, series: Series) -> MasterKey:
+        """Combine a series into its master and add it to the library (replacing one with the same key)."""
+        try:
+            master = series.combine()
+        finally:
+            series.close()
+        key = series.key
+        if series.temperatures:
+            key = key._replace(temperature=round(float(np.mean(series.temperatures))) if key.kind != "flat" else None)
+        if key.kind == "flat":
+            offset_key = self.find("bias", 0, key.gain, key.offset, key.bin, None)
+            if offset_key is not None and self.master(offset_key).shape == master.shape:
+                master -= self.master(offset_key)
+            master /= float(np.mean(master))
+
+        header = fits.Header()
+        header["IMAGETYP"] = {"bias": "Bias Frame", "dark": "Dark Frame", "flat": "Flat Field"}[key.kind]
+        header["EXPTIME"] = key.exposure / 1e6
+        header["EGAIN"] = key.gain
+        header["OFFSET"] = key.offset
+        header["XBINNING"], header["YBINNING"] = key.bin
+        if key.temperature is not None:
+            header["CCD-TEMP"] = key.temperature
+        header["NCOMBINE"] = series.frames
+        header["DATE"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+        path = os.path.join(self.directory, key.filename())
+        fits.PrimaryHDU(master, header=header).writeto(path, overwrite=True)
+        with self._lock:
+            self._masters[key] = path
+            self._cache.pop(key, None)
+        return key
+
+    def remove(self, name: str) -> bool:
+        with self._lock:
+            for key, path in self._masters.items():
+                if key.filename() == name:
+                    del self._masters[key]
+                    self._cache.pop(key, None)
+                    os.remove(path)
+                    return True
+        return False
+
+    def find(self, kind: str, exposure: int, gain: int, offset: int, bin_mode: tuple[int, int],
+             temperature: Optional[float]) -> Optional[MasterKey]:
+        """Key of the master matching a frame, the one at the nearest temperature within the tolerance."""
+        wanted = MasterKey.of(kind, exposure, gain, offset, bin_mode, None)
+        best, best_delta = None, None
+        with self._lock:
+            for key in self._masters:
+                if key[:5] != wanted[:5]:
+                    continue
+                if key.temperature is None or temperature is None:
+                    delta = 0.0 if key.temperature is None else TEMPERATURE_TOLERANCE
+                else:
+                    delta = abs(key.temperature - temperature)
+                if delta <= TEMPERATURE_TOLERANCE and (best_delta is None or delta < best_delta):
+                    best, best_delta = key, delta
+        return best
+
+    def master(self, key: MasterKey) -> np.ndarray:
+        """The master frame as float32, flats as their reciprocal (so that applying them is a multiply)."""
+        with self._lock:
+            master = self._cache.get(key)
+            if master is not None:
+                self._cache.move_to_end(key)
+                return master
+            path = self._masters[key]
+        master = fits.getdata(path).astype(np.float32)
+        if key.kind == "flat":
+            usable = master > FLAT_FLOOR
+            master = np.divide(1.0, master, out=np.ones_like(master), where=usable)
+        master.flags.writeable = False
+        with self._lock:
+            self._cache[key] = master
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return master
+
+    def apply(self, array: np.ndarray, exposure: int, gain: int, offset: int, bin_mode: tuple[int, int] = (1, 1),
+              temperature: Optional[float] = None) -> list[str]:
+        """Calibrate a frame in place, returns the kinds of the masters applied (empty if none matched)."""
+        dark = self.find("dark", exposure, gain, offset, bin_mode, temperature)
+        dark = dark or self.find("bias", exposure, gain, offset, bin_mode, temperature)
+        flat = self.find("flat", exposure, gain, offset, bin_mode, temperature)
+        dark_frame = self.master(dark) if dark is not None else None
+        flat_frame = self.master(flat) if flat is not None else None
+        if dark_frame is not None and dark_frame.shape != array.shape:
+            dark, dark_frame = None, None       # a master of another region of interest
+        if flat_frame is not None and flat_frame.shape != array.shape:
+            flat, flat_frame = None, None
+        if dark is None and flat is None:
+            return []
+
+        scratch = getattr(self._local, "scratch", None)
+        if scratch is None or scratch.shape != array.shape:
+            scratch = self._local.scratch = np.empty(array.shape, dtype=np.float32)
+        np.copyto(scratch, array)
+        if dark_frame is not None:
+            scratch -= dark_frame
+        if flat_frame is not None:
+            scratch *= flat_frame
+        # the 0.5 rounds to the nearest integer on the cast
+        scratch += (PEDESTAL if dark_frame is not None else 0) + 0.5
+        np.clip(scratch, 0, np.iinfo(array.dtype).max, out=scratch)
+        np.copyto(array, scratch, casting="unsafe")
+        return [key.kind for key in (dark, flat) if key is not None]
@@ -1,14 +1,91 @@
+from __future__ import annotations
+
+import os
 import time
 import ctypes
-
-import cv2
-import numpy as np
-from astropy.io import fits
+import weakref
+import itertools
+from threading import Lock
+from typing import TYPE_CHECKING, Callable, Iterator, Optional
+
+import lazy
+from stretch import PreviewEncoder
+
+if TYPE_CHECKING:
+    from emulator import SkyEmulator
+
+np = lazy.load("numpy")
+fits = lazy.load("astropy.io.fits")
+
+POLL_INTERVAL = 0.01        # seconds between two checks of ``should_stop`` while exposing
+PROGRESS_INTERVAL = 1.0     # seconds between two calls of the ``progress`` callback
+READOUT_GRACE = 1.0         # seconds the SDK may still report exposure time left after the deadline
+# lossless tile compression of the FITS files, the name used in the settings -> astropy compression type
+FITS_COMPRESSION = {"none": None, "rice": "RICE_1", "hcompress": "HCOMPRESS_1"}
+
+
+class ExposureCancelled(Exception):
+    """Raised by ``Camera.expose`` when ``should_stop`` returned True before the frame was read out."""
+
+
+class FramePool:
+    """
+    Reusable frame buffers, keyed by the exposure geometry (region, bin mode, bit depth).
+
+    ``acquire`` hands out a free buffer of the right size or allocates one, the owner
+    of the frame gives it back with ``release`` once it is done with it (e.g. after the
+    writer saved it). Frames that are never released are simply garbage collected.
+    """
+
+    def __init__(self, max_free: int = 16) -> None:
+        self.max_free = max_free
+        self._lock = Lock()
+        self._free: dict[tuple, list[np.ndarray]] = {}
+        self._lent: dict[int, tuple[tuple, weakref.ref]] = {}     # id(buffer) -> (key, buffer)
+        self.allocated = 0
+        self.reused = 0
+
+    def acquire(self, key: tuple, size: int) -> np.ndarray:
+        """Flat uint16 buffer of ``size`` pixels, frames are views of it."""
+        with self._lock:
+            free = self._free.get(key)
+            if free:
+                self.reused += 1
+                buffer = free.pop()
+            else:
+                self.allocated += 1
+                buffer = np.empty(size, dtype=np.uint16)
+            if len(self._lent) > 4 * self.max_free:
+                # forget the buffers that were dropped without being released
+                self._lent = {i: entry for i, entry in self._lent.items() if entry[1]() is not None}
+            self._lent[id(buffer)] = (key, weakref.ref(buffer))
+        return buffer
+
+    def release(self, frame: np.ndarray) -> None:
+        # frames are reshaped views, numpy keeps the buffer owning the memory as their base
+        buffer = frame if frame.base is None else frame.base
+        with self._lock:
+            entry = self._lent.get(id(buffer))
+            if entry is None or entry[1]() is not buffer:
+                return      # not from this pool (e.g. a live stream ring buffer)
+            del self._lent[id(buffer)]
+            free = self._free.setdefault(entry[0], [])
+            if len(free) < self.max_free:
+                free.append(buffer)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "allocated": self.allocated,
+                "reused": self.reused,
+                "free": sum(len(free) for free in self._free.values()),
+            }
 
 
 class Camera:
 
-    def __init__(self, project_path: str, emulate=False) -> None:
+    def __init__(self, project_path: str, emulate=False, use_pool=True,
+                 emulator: Optional[SkyEmulator] = None) -> None:
         if not emulate:
             self.funcs = ctypes.CDLL(f"{project_path}/shared/libcamera.so")
             self._set_arg_res_types()
@@ -28,6 +105,19 @@ class Camera:
         self.offset = None
         self.exposureTime = None
 
+        # None disables pooling: every exposure allocates a new frame, as before
+        self.pool = FramePool() if use_pool else None
+        self._region = np.zeros(4, dtype=np.uint32)
+        self._p_region = self._region.ctypes.data_as(ctypes.POINTER(ctypes.c_uint32))
+        self._exposing: Optional[tuple[float, float]] = None    # (start, duration) of the current exposure
+        self._sdk_remaining: Optional[float] = None
+        # measured seconds of the last frame: "exposure" until the sensor is read, "readout" of the frame
+        self.last_timings: dict[str, float] = {}
+        if emulate:
+            # imported here, the emulator imports its timings from this module
+            from emulator import SkyEmulator
+            self.emulator = emulator or SkyEmulator(self.resolution)
+
     def _get_sdk_version(self) -> str:
         if self.emulate:
             return "Emulated"
@@ -58,6 +148,15 @@ class Camera:
         self.funcs.getChipInfo.restype = ctypes.c_uint
         self.funcs.initCamera.restype = ctypes.c_uint
         self.funcs.expose.restype = ctypes.c_uint
+        self.funcs.beginLive.restype = ctypes.c_uint
+        self.funcs.startLive.restype = ctypes.c_uint
+        self.funcs.getLiveFrame.restype = ctypes.c_uint
+        self.funcs.stopLive.restype = ctypes.c_uint
+        self.funcs.startExposure.restype = ctypes.c_uint
+        self.funcs.exposureRemaining.restype = ctypes.c_uint
+        self.funcs.cancelExposure.restype = ctypes.c_uint
+        self.funcs.readExposure.restype = ctypes.c_uint
+        self.funcs.getTemperature.restype = ctypes.c_uint
 
     def _get_camera_id(self) -> str:
         if self.emulate:
@@ -166,13 +265,139 @@ class Camera:
         if retVal:
             raise RuntimeError("Error setting bit depth")
 
-    def expose(self, exposureTime, exp_region=None, bin_mode=(1, 1), gain=10, offset=140, bbp=16) \
+    def expose(self, exposureTime, exp_region=None, bin_mode=(1, 1), gain=10, offset=140, bbp=16,
+               should_stop: Optional[Callable[[], bool]] = None, progress: Optional[Callable[[], None]] = None) \
             -> tuple[np.ndarray, float]:
+        """
+        Single frame, returns (frame, seconds spent exposing and reading out).
+
+        The exposure is started asynchronously and waited for here: ``should_stop`` is checked
+        every ``POLL_INTERVAL`` and aborts the exposure with ``ExposureCancelled``, and
+        ``progress`` is called every ``PROGRESS_INTERVAL`` (see ``exposure_progress``).
+        The two parts of the time are then in ``last_timings``.
+        """
+        poll = self._poll(should_stop, progress)
         if self.emulate:
-            time.sleep(exposureTime / 1000 / 1000)
-            image_data = np.random.randint(0, 65535, (1080, 1920), dtype=np.uint16)
-            return image_data, exposureTime
+            if exp_region is None:
+                exp_region = (0, 0, self.resolution[0], self.resolution[1])
+            height, width = self.emulator.frame_shape(exp_region, bin_mode)
+            pixels = self._acquire((tuple(exp_region), tuple(bin_mode), bbp), width * height)
+            exposure_start = time.time()
+            self._exposing = (exposure_start, exposureTime / 1e6)
+            try:
+                frame = self.emulator.expose(exposureTime, exp_region, bin_mode, gain, offset, bbp,
+                                             out=pixels.reshape(height, width), should_stop=poll)
+            except BaseException:
+                # the frame is not handed out, its buffer goes back to the pool
+                self.release(pixels)
+                raise
+            finally:
+                self._exposing = None
+            if frame is None:
+                self.release(pixels)
+                raise ExposureCancelled()
+            now = time.time()
+            readout_start = self.emulator.exposure_end
+            self.last_timings = {"exposure": readout_start - exposure_start, "readout": now - readout_start}
+            return frame, now - exposure_start
+
+        exp_region = self._apply_settings(exposureTime, exp_region, bin_mode, gain, offset, bbp)
+
+        """for exp_region: (start_x, start_y, width, height)"""
+        key = (tuple(exp_region), tuple(bin_mode), bbp)
+        pixels = self._acquire(key, exp_region[2] * exp_region[3])
+        p_pixels = pixels.ctypes.data_as(ctypes.POINTER(ctypes.c_uint16))
+
+        # the SDK writes the size of the frame it returns into the region
+        self._region[:] = exp_region
 
+        exposure_start = time.time()
+        self._exposing = (exposure_start, exposureTime / 1e6)
+        try:
+            if self.funcs.startExposure(self.cam_ptr):
+                raise RuntimeError("Error starting exposure")
+            if not self._wait_exposure(exposure_start + exposureTime / 1e6, poll):
+                self.funcs.cancelExposure(self.cam_ptr)
+                raise ExposureCancelled()
+            readout_start = time.time()
+            # ctypes releases the GIL while the SDK reads the frame out
+            retVal = self.funcs.readExposure(self.cam_ptr, p_pixels, bbp, self._p_region)
+        except BaseException:
+            # the frame is not handed out, its buffer goes back to the pool
+            self.release(pixels)
+            raise
+        finally:
+            self._exposing = None
+            self._sdk_remaining = None
+        now = time.time()
+        actual_exposure = now - exposure_start
+
+        match retVal:
+            case 0:
+                self.last_timings = {"exposure": readout_start - exposure_start, "readout": now - readout_start}
+                width, height = int(self._region[2]), int(self._region[3])
+                return pixels[:width * height].reshape(height, width), actual_exposure
+            case 2:
+                self.release(pixels)
+                raise RuntimeError("Error reading data")
+            case _:
+                self.release(pixels)
+                raise RuntimeError("Unknown error")
+
+    def _wait_exposure(self, deadline: float, poll: Callable[[], bool]) -> bool:
+        """Wait for the exposure started by ``startExposure`` to end, False if ``poll`` asked to stop."""
+        while True:
+            self._sdk_remaining = self.funcs.exposureRemaining(self.cam_ptr) / 1000
+            now = time.time()
+            if now >= deadline and (self._sdk_remaining == 0 or now >= deadline + READOUT_GRACE):
+                return True
+            if poll():
+                return False
+            time.sleep(min(max(deadline - now, 0.001), POLL_INTERVAL))
+
+    @staticmethod
+    def _poll(should_stop: Optional[Callable[[], bool]], progress: Optional[Callable[[], None]]) \
+            -> Callable[[], bool]:
+        last_progress = 0.0
+
+        def poll() -> bool:
+            nonlocal last_progress
+            if progress is not None and time.time() - last_progress >= PROGRESS_INTERVAL:
+                last_progress = time.time()
+                progress()
+            return should_stop is not None and should_stop()
+        return poll
+
+    def temperature(self) -> Optional[float]:
+        """Sensor temperature in degrees C, None if the camera has no sensor."""
+        if self.emulate:
+            return self.emulator.temperature
+        temperature = ctypes.c_double()
+        if self.funcs.getTemperature(self.cam_ptr, ctypes.byref(temperature)):
+            return None
+        return temperature.value
+
+    def exposure_progress(self) -> Optional[dict]:
+        """Elapsed and total seconds of the exposure in progress, None between exposures."""
+        exposing = self._exposing
+        if exposing is None:
+            return None
+        start, duration = exposing
+        elapsed = min(time.time() - start, duration)
+        remaining = self._sdk_remaining if self._sdk_remaining is not None else duration - elapsed
+        return {"elapsed": round(elapsed, 1), "duration": duration, "remaining": round(remaining, 1)}
+
+    def _acquire(self, key: tuple, size: int) -> np.ndarray:
+        if self.pool is None:
+            return np.zeros(size, dtype=np.uint16)
+        return self.pool.acquire(key, size)
+
+    def release(self, frame: np.ndarray) -> None:
+        """Give a frame returned by ``expose`` back to the pool once it is no longer used."""
+        if self.pool is not None:
+            self.pool.release(frame)
+
+    def _apply_settings(self, exposureTime, exp_region, bin_mode, gain, offset, bbp) -> tuple[int, int, int, int]:
         if exp_region is None:
             exp_region = (0, 0, self.resolution[0], self.resolution[1])
         print(exp_region)
@@ -201,26 +426,87 @@ class Camera:
             self._set_exposure(exposureTime)
             self.exposureTime = exposureTime
 
-        """for exp_region: (start_x, start_y, width, height)"""
-        pixels = np.zeros(exp_region[2] * exp_region[3], dtype=np.uint16)
-        p_pixels = pixels.ctypes.data_as(ctypes.POINTER(ctypes.c_uint16))
+        return exp_region
 
-        exp_region = np.array(exp_region, dtype=np.uint32)
-        p_exp_region = exp_region.ctypes.data_as(ctypes.POINTER(ctypes.c_uint32))
+    def _reset_settings(self) -> None:
+        # re-initializing the camera drops the exposure parameters, they are sent again on the next exposure
+        self.binMode = None
+        self.expRegion = None
+        self.bitDepth = None
+        self.gain = None
+        self.offset = None
+        self.exposureTime = None
 
-        exposure_start = time.time()
-        retVal = self.funcs.expose(self.cam_ptr, p_pixels, bbp, p_exp_region)
-        actual_exposure = time.time() - exposure_start
+    def stream(self, exposureTime, exp_region=None, bin_mode=(1, 1), gain=10, offset=140, bbp=16,
+               ring_size=4, should_stop: Optional[Callable[[], bool]] = None) \
+            -> Iterator[tuple[np.ndarray, float]]:
+        """
+        Continuous capture in the SDK's live mode, yields (frame, seconds since the previous frame).
 
-        match retVal:
-            case 0:
-                return pixels.reshape(exp_region[3], exp_region[2]), actual_exposure
-            case 1:
-                raise RuntimeError("Error starting exposure")
-            case 2:
-                raise RuntimeError("Error reading data")
-            case _:
-                raise RuntimeError("Unknown error")
+        Frames are read into a ring of ``ring_size`` preallocated buffers, so a yielded
+        array is overwritten ``ring_size`` frames later. Consumers that hold on to frames
+        (e.g. a write queue) need a ring larger than the number of frames they keep.
+        """
+        if exp_region is None:
+            exp_region = (0, 0, self.resolution[0], self.resolution[1])
+        ring = [np.zeros(exp_region[2] * exp_region[3], dtype=np.uint16) for _ in range(ring_size)]
+
+        if self.emulate:
+            height, width = self.emulator.frame_shape(exp_region, bin_mode)
+            last_frame = time.time()
+            for i in itertools.count():
+                if should_stop is not None and should_stop():
+                    return
+                frame = ring[i % ring_size][:width * height].reshape(height, width)
+                exposure_start = time.time()
+                if self.emulator.expose(exposureTime, exp_region, bin_mode, gain, offset, bbp, out=frame,
+                                        should_stop=should_stop) is None:
+                    return
+                now = time.time()
+                readout_start = self.emulator.exposure_end
+                self.last_timings = {"exposure": readout_start - exposure_start, "readout": now - readout_start}
+                yield frame, now - last_frame
+                last_frame = now
+
+        retVal = self.funcs.beginLive(self.cam_ptr)
+        if retVal == 1:
+            raise RuntimeError("Failed to set the camera's stream mode")
+        elif retVal == 2:
+            raise RuntimeError("Failed to initialize the camera")
+        self._reset_settings()
+
+        try:
+            exp_region = self._apply_settings(exposureTime, exp_region, bin_mode, gain, offset, bbp)
+            region = np.array(exp_region, dtype=np.uint32)
+            p_region = region.ctypes.data_as(ctypes.POINTER(ctypes.c_uint32))
+            p_ring = [buffer.ctypes.data_as(ctypes.POINTER(ctypes.c_uint16)) for buffer in ring]
+
+            if self.funcs.startLive(self.cam_ptr):
+                raise RuntimeError("Error starting the live stream")
+
+            i, last_frame = 0, time.time()
+            while should_stop is None or not should_stop():
+                readout_start = time.time()
+                retVal = self.funcs.getLiveFrame(self.cam_ptr, p_ring[i % ring_size], bbp, p_region)
+                if retVal == 1:
+                    time.sleep(0.001)   # the next frame is not ready yet
+                    continue
+                elif retVal:
+                    raise RuntimeError("Error reading data")
+
+                # the SDK reports the size of the frame it returned (e.g. after binning)
+                width, height = int(region[2]), int(region[3])
+                frame = ring[i % ring_size][:width * height].reshape(height, width)
+                now = time.time()
+                # the live mode exposes the next frame while this one is read, only the readout is known
+                self.last_timings = {"readout": now - readout_start}
+                yield frame, now - last_frame
+                i, last_frame = i + 1, now
+        finally:
+            retVal = self.funcs.stopLive(self.cam_ptr)
+            self._reset_settings()
+            if retVal:
+                print("Failed to return the camera to single frame mode")
 
     def close(self) -> None:
         if self.connected:
@@ -236,8 +522,16 @@ class Camera:
                 f"Max Depth: {self.max_depth} bit")
 
     @staticmethod
-    def array_to_fits(array: np.ndarray, filename: str, info: dict) -> None:
-        hdu = fits.PrimaryHDU(array)
+    def array_to_fits(array: np.ndarray, filename: str, info: dict, compression: str = "none") -> None:
+        """
+        compression: a key of ``FITS_COMPRESSION``, compressed frames are a ``CompImageHDU``
+        after an empty primary HDU (the layout of fpack), still saved as ``<filename>.fits``
+        """
+        compression_type = FITS_COMPRESSION[compression]
+        if compression_type is None:
+            hdu = fits.PrimaryHDU(array)
+        else:
+            hdu = fits.CompImageHDU(array, compression_type=compression_type)
         hdu.header["INSTRUME"] = "QHY5III678M"
         hdu.header["CAMID"] = "71e8254fbdd757e37"
         hdu.header["FRAMETYP"] = 'Light'
@@ -247,30 +541,26 @@ class Camera:
         hdu.header["OFFSET"] = info["offset"]
         hdu.header["DATE-OBS"] = info["timestamp"]
         hdu.header["TAG"] = info["tag"]
-
-        hudl = fits.HDUList([hdu])
+        if info.get("temperature") is not None:
+            hdu.header["CCD-TEMP"] = round(info["temperature"], 1)
+        if info.get("calibration"):
+            hdu.header["CALIBRAT"] = info["calibration"]
+        if info.get("hot_pixels") is not None:
+            hdu.header["HOTPIX"] = info["hot_pixels"]
+        if info.get("meteors") is not None:
+            hdu.header["METEORS"] = info["meteors"]
+
+        hudl = fits.HDUList([hdu] if compression_type is None else [fits.PrimaryHDU(), hdu])
         hudl.writeto(f"{filename}.fits", overwrite=True)
 
     @staticmethod
-    def array_to_png(array: np.ndarray, filename: str) -> None:
-        # Step 1: Read the 16-bit monochrome image array
-        original_height, original_width = array.shape
-
-        # Step 2: Resize the image to 1/4 of its original resolution
-        new_width = original_width // 2
-        new_height = original_height // 2
-        resized_image = cv2.resize(array, (new_width, new_height), interpolation=cv2.INTER_AREA)
-
-        # Step 3: Normalize the image data to 8-bit
-        normalized_image = cv2.normalize(resized_image, None, 0, 255, cv2.NORM_MINMAX)
-        normalized_image = np.uint8(normalized_image)
-
-        # Step 4: Save the resized image as a PNG file
-        cv2.imwrite(f"{filename}.png", normalized_image)
+    def image_hdu(hdul: fits.HDUList):
+        """The HDU holding the frame, in plain and tile compressed FITS files alike."""
+        return hdul[0] if hdul[0].header.get("NAXIS") else hdul[1]
 
     @staticmethod
-    def fits_to_png(fits_file: str) -> None:
-        hdu = fits.open(fits_file)
-        data = hdu[0].data
-        Camera.array_to_png(data, fits_file.rstrip(".fits"))
-        hdu.close()
+    def fits_to_png(fits_file: str, encoder: Optional[PreviewEncoder] = None) -> str:
+        """Write the preview of a FITS file next to it (a PNG unless ``encoder`` says otherwise), returns its path."""
+        with fits.open(fits_file) as hdul:
+            data = Camera.image_hdu(hdul).data
+            return (encoder or PreviewEncoder("png")).write(data, os.path.splitext(fits_file)[0])
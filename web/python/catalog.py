@@ -0,0 +1,95 @@
+import os
+from threading import Thread, Lock, Event
+from typing import Iterable, Sequence
+
+import layout
+
+
+class ImageCatalog:
+    """
+    In-memory listing of the frames in the (date partitioned) image directory.
+
+    The capture writers and the delete path keep it up to date with ``add`` and
+    ``discard``; files copied in or removed by hand are picked up by a background
+    thread that re-lists a partition whenever its mtime changes.
+    """
+
+    def __init__(self, img_dir: str, resync_interval: float = 5.0, extensions: Sequence[str] = (".png",)) -> None:
+        self.img_dir = img_dir
+        self.extensions = tuple(extensions)     # of the preview images that make a frame visible
+        self.resync_interval = resync_interval
+        self._lock = Lock()
+        self._names: set[str] = set()
+        self._snapshot: tuple[str, ...] = ()
+        self._dirty = False
+        self._partitions: dict[str, tuple[int, set[str]]] = {}    # partition -> (mtime, names listed)
+        self._stop = Event()
+        self._watcher = None
+        self.resync(force=True)
+
+    def _list_dir(self, path: str) -> set[str]:
+        with os.scandir(path) as entries:
+            return {os.path.splitext(entry.name)[0] for entry in entries if entry.name.endswith(self.extensions)}
+
+    def resync(self, force: bool = False) -> bool:
+        """Re-list the partitions that changed since the last listing, returns True if any did."""
+        partitions = {}
+        changed = False
+        for partition, path in layout.partitions(self.img_dir):
+            mtime = os.stat(path).st_mtime_ns
+            previous = self._partitions.get(partition)
+            if force or previous is None or previous[0] != mtime:
+                partitions[partition] = (mtime, self._list_dir(path))
+                changed = True
+            else:
+                partitions[partition] = previous
+        changed = changed or partitions.keys() != self._partitions.keys()
+        if not changed:
+            return False
+        with self._lock:
+            self._partitions = partitions
+            self._names = set().union(*(names for _, names in partitions.values()))
+            self._dirty = True
+        return True
+
+    def start(self) -> None:
+        def watch():
+            while not self._stop.wait(self.resync_interval):
+                try:
+                    self.resync()
+                except OSError as e:
+                    print(f"Failed to resync the image catalog: {e}")
+
+        self._watcher = Thread(target=watch, daemon=True)
+        self._watcher.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._watcher is not None:
+            self._watcher.join()
+
+    def add(self, name: str) -> None:
+        with self._lock:
+            if name not in self._names:
+                self._names.add(name)
+                self._dirty = True
+
+    def discard(self, names: Iterable[str]) -> None:
+        with self._lock:
+            before = len(self._names)
+            self._names.difference_update(names)
+            self._dirty = self._dirty or len(self._names) != before
+
+    def names(self) -> tuple[str, ...]:
+        """Sorted snapshot of the frame names, rebuilt only after the catalog changed."""
+        with self._lock:
+            if self._dirty:
+                self._snapshot = tuple(sorted(self._names))
+                self._dirty = False
+            return self._snapshot
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._names
+
+    def __len__(self) -> int:
+        return len(self._names)
@@ -0,0 +1,184 @@
+from __future__ import annotations
+
+import time
+from typing import Callable, Optional
+
+import lazy
+from camera import POLL_INTERVAL
+
+np = lazy.load("numpy")
+cv2 = lazy.load("cv2")
+
+
+class SkyEmulator:
+    """
+    Deterministic synthetic night sky used by ``Camera(emulate=True)``.
+
+    The sky is modeled in electrons per second per pixel (a light pollution gradient,
+    a seeded star field and a few hot pixels) and every exposure turns it into ADU
+    with shot noise, read noise, gain and offset, so the frames compress, stretch and
+    trigger detections like real data does. ROI, binning and bit depth are honored,
+    and the readout time of the USB link is simulated from the size of the frame.
+    With ``covered`` set (lens cap on) the frames only have the dark signal, for
+    calibration darks and bias. A ``meteor_rate`` above 0 adds a streak to that
+    fraction of the frames, ``meteors`` has the end points of the last frame's one.
+    """
+
+    def __init__(self, resolution: tuple[int, int], seed: int = 0, stars_per_mpix: int = 1500,
+                 sky_rate: float = 40.0, read_noise: float = 1.5, hot_pixel_fraction: float = 1e-4,
+                 dark_current: float = 0.05, temperature: float = 20.0, meteor_rate: float = 0.0,
+                 usb_rate: float = 200e6, readout_overhead: float = 0.005) -> None:
+        """
+        resolution: (width, height) of the sensor
+        sky_rate: sky background at the top of the frame, in e-/s/pixel
+        read_noise: in e- rms
+        dark_current: in e-/s/pixel, hot pixels excluded
+        temperature: reported sensor temperature in degrees C
+        meteor_rate: probability of a meteor in a frame
+        usb_rate: bytes per second of the simulated USB link
+        readout_overhead: fixed readout time in seconds, added to the transfer time
+        """
+        self.resolution = resolution
+        self.seed = seed
+        self.read_noise = read_noise
+        self.usb_rate = usb_rate
+        self.readout_overhead = readout_overhead
+        self.temperature = temperature
+        self.meteor_rate = meteor_rate
+        self.meteors: list[tuple[int, int, int, int]] = []
+        self.covered = False
+        self.frame_count = 0
+        self.exposure_end: Optional[float] = None     # time the last exposure ended and its readout started
+
+        width, height = resolution
+        rng = np.random.default_rng(seed)
+
+        # light pollution: brighter towards the bottom (horizon) and one side
+        y = np.linspace(0.0, 1.0, height, dtype=np.float32)[:, None]
+        x = np.linspace(0.0, 1.0, width, dtype=np.float32)[None, :]
+        sky = sky_rate * (1.0 + 3.0 * y ** 2 + 0.5 * x)
+
+        # stars: log-uniform fluxes, gaussian PSF stamped with one vectorized scatter-add per offset
+        n_stars = int(stars_per_mpix * width * height / 1e6)
+        star_x = rng.uniform(2, width - 3, n_stars)
+        star_y = rng.uniform(2, height - 3, n_stars)
+        flux = 10 ** rng.uniform(2.0, 5.0, n_stars)
+        cx, cy = np.rint(star_x).astype(np.int64), np.rint(star_y).astype(np.int64)
+        sigma = 1.2
+        for dy in range(-2, 3):
+            for dx in range(-2, 3):
+                weight = np.exp(-((cx + dx - star_x) ** 2 + (cy + dy - star_y) ** 2) / (2 * sigma ** 2))
+                np.add.at(sky, (cy + dy, cx + dx), (flux * weight / (2 * np.pi * sigma ** 2)).astype(np.float32))
+
+        # dark signal: a small dark current everywhere, hot pixels at fixed positions with a large one
+        n_hot = int(hot_pixel_fraction * width * height)
+        self.hot_pixels = (rng.integers(0, height, n_hot), rng.integers(0, width, n_hot))
+        dark = np.full((height, width), dark_current, dtype=np.float32)
+        dark[self.hot_pixels] += rng.uniform(200, 2000, n_hot).astype(np.float32)
+
+        self.dark = dark
+        self.sky = sky + dark
+        self._binned: dict[tuple, np.ndarray] = {}
+        self._scratch: dict[tuple, np.ndarray] = {}
+
+    def _sky_of(self, exp_region: tuple, bin_mode: tuple) -> np.ndarray:
+        key = (tuple(exp_region), tuple(bin_mode), self.covered)
+        sky = self._binned.get(key)
+        if sky is None:
+            x, y, w, h = exp_region
+            bx, by = bin_mode
+            region = (self.dark if self.covered else self.sky)[y:y + h, x:x + w]
+            h, w = region.shape[0] // by, region.shape[1] // bx
+            sky = region[:h * by, :w * bx].reshape(h, by, w, bx).sum(axis=(1, 3))
+            self._binned[key] = sky
+        return sky
+
+    def frame_shape(self, exp_region: tuple, bin_mode: tuple) -> tuple[int, int]:
+        return self._sky_of(exp_region, bin_mode).shape
+
+    @staticmethod
+    def adu_per_electron(gain: int) -> float:
+        # roughly the conversion gain curve of a CMOS sensor: 0.25 ADU/e- at gain 0, x10 every 200 gain steps
+        return 0.25 * 10 ** (gain / 200)
+
+    def readout_time(self, shape: tuple[int, int], bbp: int) -> float:
+        return self.readout_overhead + shape[0] * shape[1] * (2 if bbp > 8 else 1) / self.usb_rate
+
+    def render(self, exposure: int, exp_region: Optional[tuple] = None, bin_mode=(1, 1), gain=10, offset=140,
+               bbp=16, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """Render one frame of ``exposure`` microseconds into ``out`` (uint16, allocated if None)."""
+        if exp_region is None:
+            exp_region = (0, 0, self.resolution[0], self.resolution[1])
+        sky = self._sky_of(exp_region, bin_mode)
+        if out is None:
+            out = np.empty(sky.shape, dtype=np.uint16)
+
+        # each frame has its own noise, but the n-th frame is the same on every run
+        rng = np.random.default_rng((self.seed, self.frame_count))
+        self.frame_count += 1
+
+        scratch = self._scratch.get(sky.shape)
+        if scratch is None:
+            scratch = self._scratch[sky.shape] = np.empty(sky.shape, dtype=np.float32)
+
+        # electrons, shot noise and read noise approximated by a single gaussian draw
+        np.multiply(sky, exposure / 1e6, out=scratch)
+        noise = rng.standard_normal(sky.shape, dtype=np.float32)
+        self.meteors = []
+        if not self.covered and rng.random() < self.meteor_rate:
+            self._add_meteor(scratch, rng)
+        noise *= np.sqrt(scratch + self.read_noise ** 2)
+        scratch += noise
+
+        # to ADU: conversion gain, bias from the offset, clip to the bit depth
+        scratch *= self.adu_per_electron(gain)
+        scratch += offset * 4
+        np.clip(scratch, 0, 65535, out=scratch)
+        if bbp < 16:
+            # lower bit depths keep the most significant bits of the ADC
+            scratch *= 2.0 ** (bbp - 16)
+            np.floor(scratch, out=scratch)
+        np.copyto(out, scratch, casting='unsafe')
+        return out
+
+    def _add_meteor(self, scratch: np.ndarray, rng: np.random.Generator) -> None:
+        # a streak over a random part of the frame, its electrons do not depend on the exposure (it lasts < 1 s)
+        height, width = scratch.shape
+        length = rng.uniform(0.1, 0.4) * min(height, width)
+        angle = rng.uniform(0, np.pi)
+        x0, y0 = rng.uniform(0.1 * width, 0.9 * width), rng.uniform(0.1 * height, 0.9 * height)
+        x1 = int(np.clip(x0 + length * np.cos(angle), 0, width - 1))
+        y1 = int(np.clip(y0 + length * np.sin(angle), 0, height - 1))
+        cv2.line(scratch, (int(x0), int(y0)), (x1, y1), float(rng.uniform(300, 3000)), thickness=2)
+        self.meteors.append((int(x0), int(y0), x1, y1))
+
+    def expose(self, exposure: int, exp_region: Optional[tuple] = None, bin_mode=(1, 1), gain=10, offset=140,
+               bbp=16, out: Optional[np.ndarray] = None, should_stop: Optional[Callable[[], bool]] = None) \
+            -> Optional[np.ndarray]:
+        """
+        Like ``render`` but takes as long as the real camera: exposure plus USB readout.
+
+        Returns None, within ``POLL_INTERVAL``, if ``should_stop`` returns True before the frame is read out.
+        """
+        start = time.time()
+        if not self._wait(start + exposure / 1e6, should_stop):
+            return None
+        self.exposure_end = time.time()
+        frame = self.render(exposure, exp_region, bin_mode, gain, offset, bbp, out)
+        # rendering stands in for part of the readout
+        if not self._wait(start + exposure / 1e6 + self.readout_time(frame.shape, bbp), should_stop):
+            return None
+        return frame
+
+    @staticmethod
+    def _wait(deadline: float, should_stop: Optional[Callable[[], bool]]) -> bool:
+        if should_stop is None:
+            remaining = deadline - time.time()
+            if remaining > 0:
+                time.sleep(remaining)
+            return True
+        while (remaining := deadline - time.time()) > 0:
+            if should_stop():
+                return False
+            time.sleep(min(remaining, POLL_INTERVAL))
+        return True
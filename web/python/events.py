@@ -0,0 +1,63 @@
+import json
+import queue
+from threading import Lock
+from typing import Iterator
+
+
+class EventBroadcaster:
+    """
+    Fan-out of server events to the Server-Sent Events clients.
+
+    Producers call ``publish`` once per change, no matter how many browser tabs are
+    open; every client gets its own bounded queue, so a stalled tab only loses its
+    own events. The last value of every event is kept and replayed to new clients,
+    and publishing a value equal to the last one is a no-op.
+    """
+
+    def __init__(self, client_queue_size: int = 64, keepalive: float = 15.0) -> None:
+        self.client_queue_size = client_queue_size
+        self.keepalive = keepalive
+        self._lock = Lock()
+        self._clients: list[queue.Queue] = []
+        self._last: dict[str, str] = {}
+
+    def publish(self, event: str, data) -> None:
+        payload = json.dumps(data)
+        with self._lock:
+            if self._last.get(event) == payload:
+                return
+            self._last[event] = payload
+            clients = list(self._clients)
+        message = f"event: {event}\ndata: {payload}\n\n"
+        for client in clients:
+            try:
+                client.put_nowait(message)
+            except queue.Full:
+                # the client is not reading, drop its oldest event to make room
+                try:
+                    client.get_nowait()
+                    client.put_nowait(message)
+                except (queue.Empty, queue.Full):
+                    pass
+
+    def subscribe(self) -> Iterator[str]:
+        client: queue.Queue = queue.Queue(maxsize=self.client_queue_size)
+        with self._lock:
+            self._clients.append(client)
+            snapshot = [f"event: {event}\ndata: {payload}\n\n" for event, payload in self._last.items()]
+        try:
+            yield from snapshot
+            while True:
+                try:
+                    yield client.get(timeout=self.keepalive)
+                except queue.Empty:
+                    # a comment line keeps proxies from closing the idle connection
+                    # and lets the server notice clients that went away
+                    yield ": keepalive\n\n"
+        finally:
+            with self._lock:
+                self._clients.remove(client)
+
+    def client_count(self) -> int:
+        with self._lock:
+            return len(self._clients)
@@ -0,0 +1,162 @@
+from __future__ import annotations
+
+import re
+import operator
+from typing import Callable, Collection, Optional
+
+import lazy
+
+np = lazy.load("numpy")
+
+
+class FilterSyntaxError(ValueError):
+    pass
+
+
+FIELDS = {
+    "e": "exposure", "exposure": "exposure",
+    "g": "gain", "gain": "gain",
+    "o": "offset", "offset": "offset",
+    "t": "timestamp", "timestamp": "timestamp",
+    "m": "meteors", "meteors": "meteors",
+}
+TIME_UNITS = {"us": 1, "ms": 1000, "s": 1000000}
+OPERATORS = {
+    "<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge,
+    "==": operator.eq, "=": operator.eq, "!=": operator.ne,
+}
+
+TOKEN = re.compile(r"""
+    (?P<timestamp>\d{4}-\d{2}-\d{2}(?:[Tt]\d{2}[:\-]\d{2}(?:[:\-]\d{2}(?:\.\d+)?)?)?)
+  | (?P<number>\d+(?:\.\d+)?)(?P<unit>us|ms|s)?
+  | (?P<op><=|>=|==|!=|<|>|=)
+  | (?P<field>[a-zA-Z]+)
+""", re.VERBOSE)
+
+
+def parse_timestamp(text: str) -> np.datetime64:
+    # windows file names use '-' instead of ':' in the time part
+    date, _, clock = text.upper().partition("T")
+    if clock:
+        clock = clock.replace("-", ":")
+        return np.datetime64(f"{date}T{clock}", "ms")
+    return np.datetime64(date, "ms")
+
+
+class SpecTable:
+    """Column-oriented copy of ``image_specs``, one row per image sorted by name."""
+
+    def __init__(self, image_specs: dict[str, dict]) -> None:
+        self.names = np.array(sorted(image_specs), dtype=object)
+        specs = [image_specs[name] for name in self.names]
+        self.row_of = {name: i for i, name in enumerate(self.names)}
+        self.columns = {
+            field: np.array([spec.get(field, -1) for spec in specs], dtype=np.int64)
+            for field in ("exposure", "gain", "offset")
+        }
+        # frames captured without the meteor detector count as none found
+        self.columns["meteors"] = np.array([spec.get("meteors", 0) for spec in specs], dtype=np.int64)
+        self.columns["timestamp"] = self._parse_timestamps([str(spec.get("timestamp", "")) for spec in specs])
+
+    @staticmethod
+    def _parse_timestamps(texts: list[str]) -> np.ndarray:
+        try:
+            return np.array(texts, dtype="datetime64[ms]")
+        except ValueError:
+            pass
+        # some timestamps are unknown or use the windows format, parse them one by one
+        timestamps = np.empty(len(texts), dtype="datetime64[ms]")
+        for i, text in enumerate(texts):
+            try:
+                timestamps[i] = parse_timestamp(text)
+            except ValueError:
+                timestamps[i] = np.datetime64("NaT")
+        return timestamps
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def mask_of(self, names: Collection[str]) -> np.ndarray:
+        mask = np.zeros(len(self.names), dtype=bool)
+        rows = [self.row_of[name] for name in names if name in self.row_of]
+        mask[rows] = True
+        return mask
+
+    def select(self, predicate: Callable[[dict], np.ndarray], names: Optional[Collection[str]] = None) -> list[str]:
+        mask = predicate(self.columns)
+        if names is not None:
+            mask &= self.mask_of(names)
+        return self.names[mask].tolist()
+
+
+def _tokenize(condition: str) -> list[tuple[str, object]]:
+    tokens, pos = [], 0
+    while pos < len(condition):
+        match = TOKEN.match(condition, pos)
+        if match is None:
+            raise FilterSyntaxError(f"Unexpected character {condition[pos]!r} in {condition!r}")
+        pos = match.end()
+        if match["timestamp"]:
+            try:
+                tokens.append(("timestamp", parse_timestamp(match["timestamp"])))
+            except ValueError:
+                raise FilterSyntaxError(f"Invalid timestamp {match['timestamp']!r}")
+        elif match["number"]:
+            value = float(match["number"]) * TIME_UNITS.get(match["unit"], 1)
+            tokens.append(("number", value))
+        elif match["op"]:
+            tokens.append(("op", OPERATORS[match["op"]]))
+        else:
+            field = match["field"].lower()
+            if field not in FIELDS:
+                raise FilterSyntaxError(f"Unknown field {match['field']!r}")
+            tokens.append(("field", FIELDS[field]))
+    return tokens
+
+
+def _compile_condition(condition: str) -> Callable[[dict], np.ndarray]:
+    """Compile one ``a op b [op c ...]`` comparison chain, e.g. ``1s<=e<10s`` or ``g>100``."""
+    tokens = _tokenize(condition)
+    if len(tokens) < 3 or len(tokens) % 2 == 0:
+        raise FilterSyntaxError(f"Incomplete condition {condition!r}")
+    operands, ops = tokens[0::2], tokens[1::2]
+    if any(kind == "op" for kind, _ in operands) or any(kind != "op" for kind, _ in ops):
+        raise FilterSyntaxError(f"Malformed condition {condition!r}")
+
+    fields = {value for kind, value in operands if kind == "field"}
+    if not fields:
+        raise FilterSyntaxError(f"Condition {condition!r} does not reference any field")
+    is_time = "timestamp" in fields
+    for kind, value in operands:
+        if (kind == "timestamp" or (kind == "field" and value == "timestamp")) != is_time:
+            raise FilterSyntaxError(f"Cannot compare timestamps with numbers in {condition!r}")
+
+    def evaluate(columns: dict) -> np.ndarray:
+        values = [columns[value] if kind == "field" else value for kind, value in operands]
+        mask = np.ones(len(columns["exposure"]), dtype=bool)
+        for (_, op), lhs, rhs in zip(ops, values, values[1:]):
+            mask &= op(lhs, rhs)
+        return mask
+
+    return evaluate
+
+
+def compile_filter(cond: str) -> Callable[[dict], np.ndarray]:
+    """
+    Compile a filter such as ``e>=100ms;g=150;t>2024-09-01T20:00`` into a function
+    mapping the columns of a ``SpecTable`` to a boolean mask. Conditions separated
+    by ``;`` are combined with AND, ``all`` matches every image with known specs.
+    ``m>0`` keeps the frames in which the meteor detector found a streak.
+    """
+    cond = cond.replace(" ", "")
+    conditions = [] if cond.lower() == "all" else [c for c in cond.split(";") if c]
+    compiled = [_compile_condition(c) for c in conditions]
+
+    def predicate(columns: dict) -> np.ndarray:
+        # filter out the images with unknown specs
+        mask = ~np.isnat(columns["timestamp"])
+        for condition in compiled:
+            mask &= condition(columns)
+        return mask
+
+    return predicate
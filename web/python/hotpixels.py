@@ -0,0 +1,229 @@
+"""
+Hot pixel map: the flat indices of the hot pixels of the sensor, and their correction.
+
+A map is a sorted uint32 array of pixel indices for a frame shape (a few hundred
+entries on a 2 Mpix sensor), saved as a small ``.npz`` file. Correcting a frame
+replaces those pixels with the median of their four neighbours, one gather and
+one scatter over the map, so it costs microseconds instead of a filter over the
+whole frame. Maps are detected in a master dark or, without darks, in the
+per-pixel median of a few recent frames (stars and meteors move, hot pixels stay).
+"""
+from __future__ import annotations
+
+import os
+import time
+from threading import Lock, Thread
+from typing import Optional
+
+import lazy
+
+np = lazy.load("numpy")
+cv2 = lazy.load("cv2")
+
+SIGMA = 6.0             # a hot pixel is this many robust sigmas above its 3x3 neighbourhood
+MIN_EXCESS = 50         # ADU above the neighbourhood, so that the noise of a very clean frame is not flagged
+SHARPNESS = 2.0         # times the excess of its brightest neighbour, a star's peak stays below
+MAX_FRACTION = 1e-3     # of the pixels, only the strongest ones are kept beyond this
+
+
+def detect(frame: np.ndarray, sigma: float = SIGMA, min_excess: float = MIN_EXCESS,
+           max_fraction: float = MAX_FRACTION) -> np.ndarray:
+    """Sorted flat indices of the pixels standing out of their neighbourhood in a dark or a median frame."""
+    frame = np.ascontiguousarray(frame)
+    if frame.dtype != np.uint16:
+        frame = np.clip(frame, 0, 65535).astype(np.uint16)
+    excess = frame.astype(np.float32)
+    excess -= cv2.medianBlur(frame, 3)
+    sample = excess[::4, ::4]
+    noise = 1.4826 * float(np.median(np.abs(sample - np.median(sample))))
+    candidates = np.flatnonzero(excess > max(sigma * noise, min_excess))
+    # a star lights up its neighbours too, a hot pixel stands alone above the ring around them
+    height, width = frame.shape
+    rows, cols = np.divmod(candidates, width)
+
+    def around(distance: int) -> np.ndarray:
+        return np.array([frame[np.clip(rows + dy, 0, height - 1), np.clip(cols + dx, 0, width - 1)]
+                         for dy in range(-distance, distance + 1) for dx in range(-distance, distance + 1)
+                         if max(abs(dy), abs(dx)) == distance], dtype=np.float32)
+
+    background = np.median(around(2), axis=0)
+    peak = frame.ravel()[candidates] - background
+    candidates = candidates[peak > SHARPNESS * (around(1).max(axis=0) - background)]
+    limit = int(max_fraction * frame.size)
+    if candidates.size > limit:
+        strongest = np.argpartition(excess.ravel()[candidates], -limit)[-limit:]
+        candidates = candidates[strongest]
+    return np.sort(candidates).astype(np.uint32)
+
+
+class HotPixelMap:
+    """Flat indices of the hot pixels of one frame shape, with the indices of their four neighbours."""
+
+    def __init__(self, shape: tuple[int, int], indices: np.ndarray) -> None:
+        self.shape = tuple(shape)
+        self.indices = np.asarray(indices, dtype=np.uint32)
+        height, width = self.shape
+        rows, cols = np.divmod(self.indices.astype(np.int64), width)
+        # left, right, up and down neighbours, mirrored at the edges of the frame
+        neighbours = np.stack([
+            rows * width + np.where(cols > 0, cols - 1, cols + 1),
+            rows * width + np.where(cols < width - 1, cols + 1, cols - 1),
+            np.where(rows > 0, rows - 1, rows + 1) * width + cols,
+            np.where(rows < height - 1, rows + 1, rows - 1) * width + cols,
+        ], axis=1)
+        self._neighbours = neighbours.astype(np.intp)
+
+    def __len__(self) -> int:
+        return len(self.indices)
+
+    @classmethod
+    def from_frame(cls, frame: np.ndarray, **kwargs) -> "HotPixelMap":
+        return cls(frame.shape, detect(frame, **kwargs))
+
+    def correct(self, array: np.ndarray) -> bool:
+        """Replace the hot pixels of a frame in place, False if the map is for another frame shape."""
+        if array.shape != self.shape or not len(self.indices):
+            return array.shape == self.shape
+        # a view of the frame when it is contiguous (camera frames are), its flat iterator otherwise
+        flat = array.reshape(-1) if array.flags.c_contiguous else array.flat
+        values = np.sort(flat[self._neighbours], axis=1)
+        # median of 4: mean of the two middle values, in a wider type to not overflow
+        flat[self.indices] = (values[:, 1].astype(np.uint32) + values[:, 2]) // 2
+        return True
+
+    def to_dict(self) -> dict:
+        return {"shape": list(self.shape), "count": len(self.indices)}
+
+
+class RollingDetector:
+    """
+    Collects one frame out of ``every`` into a stack of ``window`` frames, whose per-pixel
+    median has the hot pixels but not the stars and meteors that moved between them.
+
+    ``add`` is called with every captured frame (before any correction) and returns the
+    full stack once the window is complete, then starts a new one.
+    """
+
+    def __init__(self, window: int = 5, every: int = 10) -> None:
+        self.window = window
+        self.every = every
+        self._lock = Lock()
+        self._stack: Optional[np.ndarray] = None
+        self._frames = 0
+        self._seen = 0
+
+    def add(self, array: np.ndarray) -> Optional[np.ndarray]:
+        with self._lock:
+            self._seen += 1
+            if (self._seen - 1) % self.every:
+                return None
+            if self._stack is None or self._stack.shape[1:] != array.shape or self._stack.dtype != array.dtype:
+                self._stack = np.empty((self.window, *array.shape), dtype=array.dtype)
+                self._frames = 0
+            self._stack[self._frames] = array
+            self._frames += 1
+            if self._frames < self.window:
+                return None
+            stack, self._stack, self._frames = self._stack, None, 0
+        return stack
+
+    @staticmethod
+    def build(stack: np.ndarray) -> HotPixelMap:
+        # sorting the few frames of the stack is cheaper than np.median, which works in float64
+        return HotPixelMap.from_frame(np.sort(stack, axis=0)[len(stack) // 2])
+
+    def progress(self) -> dict:
+        with self._lock:
+            return {"frames": self._frames, "window": self.window, "every": self.every}
+
+
+class HotPixels:
+    """
+    The map in use, saved at ``path``, and the rolling detector that keeps it up to date.
+
+    A map detected in a master dark is kept until the next dark; without one the rolling
+    detector replaces the map every time it completes a window (on a thread of its own).
+    Swapping the map is a single assignment, so the writer threads correct with either
+    the old or the new one.
+    The saved map is read on first use, the server starts without numpy.
+    """
+
+    def __init__(self, path: str, window: int = 5, every: int = 10) -> None:
+        self.path = path
+        self.source: Optional[str] = None       # "dark" or "rolling"
+        self.updated: Optional[float] = None
+        self.detector = RollingDetector(window, every)
+        self._lock = Lock()
+        self._map: Optional[HotPixelMap] = None
+        self._loaded = False
+        self._builder: Optional[Thread] = None
+
+    @property
+    def map(self) -> Optional[HotPixelMap]:
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded and os.path.exists(self.path):
+                    with np.load(self.path) as data:
+                        self._map = HotPixelMap(tuple(data["shape"]), data["indices"])
+                        self.source = str(data["source"])
+                    self.updated = os.path.getmtime(self.path)
+                self._loaded = True
+        return self._map
+
+    def _set(self, hot_map: Optional[HotPixelMap], source: Optional[str]) -> None:
+        with self._lock:
+            if hot_map is None:
+                if os.path.exists(self.path):
+                    os.remove(self.path)
+            else:
+                tmp = f"{self.path}.tmp.npz"
+                np.savez_compressed(tmp, shape=np.array(hot_map.shape), indices=hot_map.indices, source=source)
+                os.replace(tmp, self.path)
+            self._map, self.source, self._loaded = hot_map, source, True
+            self.updated = time.time() if hot_map is not None else None
+        if hot_map is not None:
+            print(f"Hot pixel map of {len(hot_map)} pixels from the {source} frames")
+
+    def from_dark(self, dark: np.ndarray) -> HotPixelMap:
+        hot_map = HotPixelMap.from_frame(dark)
+        self._set(hot_map, "dark")
+        return hot_map
+
+    def observe(self, array: np.ndarray) -> None:
+        """Feed a raw frame to the rolling detector, unless the map comes from a dark of this frame shape."""
+        current = self.map
+        if self.source == "dark" and current is not None and current.shape == array.shape:
+            return
+        stack = self.detector.add(array)
+        if stack is not None and not (self._builder is not None and self._builder.is_alive()):
+            # the median takes a few hundred ms at full resolution, the writer thread does not wait for it
+            self._builder = Thread(target=self._build, args=(stack,), daemon=True)
+            self._builder.start()
+
+    def _build(self, stack: np.ndarray) -> None:
+        try:
+            hot_map = self.detector.build(stack)
+        except Exception as e:
+            print(f"Hot pixel detection failed: {e}")
+            return
+        if self.source != "dark" or self.map is None or self.map.shape != hot_map.shape:
+            self._set(hot_map, "rolling")
+
+    def correct(self, array: np.ndarray) -> int:
+        """Correct a frame in place, returns the number of pixels replaced."""
+        current = self.map
+        if current is None or not current.correct(array):
+            return 0
+        return len(current)
+
+    def clear(self) -> None:
+        self._set(None, None)
+
+    def status(self) -> dict:
+        current = self.map
+        return {
+            **(current.to_dict() if current is not None else {"shape": None, "count": 0}),
+            "source": self.source,
+            "updated": self.updated,
+            "rolling": self.detector.progress(),
+        }
@@ -0,0 +1,215 @@
+import time
+import datetime
+import uuid
+from threading import Thread, Condition, Event
+from typing import Callable, Optional
+
+DAY = 24 * 3600
+
+
+class Job:
+    """
+    One capture sequence: ``count`` frames (or until ``stop_at``) with the given settings.
+
+    A job with ``start_at`` waits in the queue until that time, and a ``daily`` job (which
+    needs one) is queued again 24 hours later once it is done, which is how a dusk-to-dawn
+    sequence is repeated every night.
+    """
+
+    def __init__(self, settings: dict, count: Optional[int], tag: Optional[str] = None,
+                 start_at: Optional[float] = None, stop_at: Optional[float] = None, daily: bool = False) -> None:
+        if count is None and stop_at is None:
+            raise ValueError("A job needs a frame count or a stop time")
+        if count is not None and count < 1:
+            raise ValueError("A job needs at least one frame")
+        if daily and start_at is None:
+            # it would be due again as soon as it ends
+            raise ValueError("A daily job needs a start time")
+        self.id = uuid.uuid4().hex[:8]
+        self.settings = settings
+        self.count = count
+        self.tag = tag
+        self.start_at = start_at
+        self.stop_at = stop_at
+        self.daily = daily
+
+        self.state = "queued"       # queued -> running -> done / cancelled / failed
+        self.done = 0
+        self.eta = ""
+        self.error: Optional[str] = None
+        self.created = time.time()
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.cancelled = Event()
+
+    def due(self, now: float) -> bool:
+        return self.start_at is None or self.start_at <= now
+
+    def should_stop(self) -> bool:
+        return self.cancelled.is_set() or (self.stop_at is not None and time.time() >= self.stop_at)
+
+    def next_night(self) -> "Job":
+        return Job(self.settings, self.count, self.tag,
+                   self.start_at + DAY if self.start_at is not None else None,
+                   self.stop_at + DAY if self.stop_at is not None else None, daily=True)
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "state": self.state,
+            "settings": self.settings,
+            "count": self.count,
+            "done": self.done,
+            "eta": self.eta,
+            "tag": self.tag,
+            "start_at": self.start_at,
+            "stop_at": self.stop_at,
+            "daily": self.daily,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "error": self.error,
+        }
+
+
+class JobManager:
+    """
+    Queue of capture jobs executed one at a time by a single capture thread.
+
+    The capture thread is the only one that talks to the camera; HTTP handlers only
+    add, list and cancel jobs and never wait for a capture to finish.
+    """
+
+    def __init__(self, run_job: Callable[[Job], None],
+                 on_change: Optional[Callable[[Optional[Job]], None]] = None, history: int = 50) -> None:
+        self.run_job = run_job
+        self.on_change = on_change
+        self.history = history
+        self._cond = Condition()
+        self._queue: list[Job] = []
+        self._finished: list[Job] = []
+        self._current: Optional[Job] = None
+        self._shutdown = False
+        self._thread = Thread(target=self._worker, daemon=True)
+        self._thread.start()
+
+    def submit(self, job: Job) -> Job:
+        with self._cond:
+            self._queue.append(job)
+            self._cond.notify()
+        return job
+
+    def current(self) -> Optional[Job]:
+        return self._current
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._cond:
+            for job in self._all():
+                if job.id == job_id:
+                    return job
+        return None
+
+    def jobs(self) -> list[Job]:
+        with self._cond:
+            return self._all()
+
+    def _all(self) -> list[Job]:
+        current = [self._current] if self._current is not None else []
+        return current + self._queue + self._finished
+
+    def cancel(self, job_id: str) -> bool:
+        with self._cond:
+            for job in self._queue:
+                if job.id == job_id:
+                    self._queue.remove(job)
+                    self._finish(job, "cancelled")
+                    return True
+            if self._current is not None and self._current.id == job_id:
+                # the capture thread notices it between two frames
+                self._current.cancelled.set()
+                return True
+        return False
+
+    def cancel_all(self) -> None:
+        with self._cond:
+            for job in self._queue:
+                self._finish(job, "cancelled")
+            self._queue.clear()
+            if self._current is not None:
+                self._current.cancelled.set()
+
+    def shutdown(self) -> None:
+        with self._cond:
+            self._shutdown = True
+            self._cond.notify()
+        self.cancel_all()
+        self._thread.join()
+
+    def _finish(self, job: Job, state: str) -> None:
+        job.state = state
+        job.finished = time.time()
+        self._finished.insert(0, job)
+        del self._finished[self.history:]
+
+    def _next_job(self) -> Optional[Job]:
+        with self._cond:
+            while not self._shutdown:
+                now = time.time()
+                due = [job for job in self._queue if job.due(now)]
+                if due:
+                    job = min(due, key=lambda j: (j.start_at or j.created))
+                    self._queue.remove(job)
+                    job.state = "running"
+                    job.started = now
+                    self._current = job
+                    return job
+                starts = [job.start_at for job in self._queue if job.start_at is not None]
+                self._cond.wait(timeout=min(starts) - now if starts else None)
+        return None
+
+    def _worker(self) -> None:
+        while (job := self._next_job()) is not None:
+            self._notify(job)
+            state = "done"
+            try:
+                self.run_job(job)
+                if job.cancelled.is_set():
+                    state = "cancelled"
+            except Exception as e:
+                job.error = str(e)
+                state = "failed"
+                print(f"Job {job.id} failed: {e}")
+            with self._cond:
+                self._current = None
+                self._finish(job, state)
+                # a failed job would most likely fail again right away, e.g. on a camera fault
+                if job.daily and state == "done":
+                    self._queue.append(job.next_night())
+            self._notify(None)
+
+    def _notify(self, job: Optional[Job]) -> None:
+        if self.on_change is not None:
+            self.on_change(job)
+
+
+def parse_time(value, after: Optional[float] = None) -> Optional[float]:
+    """
+    Epoch seconds of a job start or stop time given as epoch seconds, an ISO date or "HH:MM".
+
+    "HH:MM" is the next occurrence of that local time after ``after`` (now by default),
+    so "20:00" to "06:00" is tonight's dusk-to-dawn window.
+    """
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    after = time.time() if after is None else after
+    try:
+        moment = datetime.datetime.strptime(value, "%H:%M").time()
+    except ValueError:
+        return datetime.datetime.fromisoformat(value).timestamp()
+    reference = datetime.datetime.fromtimestamp(after)
+    candidate = datetime.datetime.combine(reference.date(), moment)
+    if candidate.timestamp() <= after:
+        candidate += datetime.timedelta(days=1)
+    return candidate.timestamp()
@@ -0,0 +1,104 @@
+"""
+Date partitioned layout of the image directory: ``<img_dir>/YYYY/MM/DD/<name>.<ext>``.
+
+The partition of a frame is read from its name (the capture timestamp), so finding
+its files never lists a directory. Names that do not start with a date stay at the
+root of the image directory.
+
+    python3 layout.py /path/to/shared/img
+
+moves the frames of a flat image directory into their partitions (one-time migration,
+the server also runs it at startup).
+"""
+import os
+import re
+import sys
+import argparse
+from typing import Iterator
+
+DATE = re.compile(r"(\d{4})-(\d{2})-(\d{2})T")
+
+
+def partition_of(name: str) -> str:
+    """Directory of a frame relative to the image directory ("YYYY/MM/DD"), "" if its name has no date."""
+    match = DATE.match(name)
+    return "/".join(match.groups()) if match else ""
+
+
+def frame_dir(img_dir: str, name: str) -> str:
+    partition = partition_of(name)
+    return os.path.join(img_dir, partition) if partition else img_dir
+
+
+def frame_path(img_dir: str, name: str, ext: str) -> str:
+    """Path of one file of a frame, ``ext`` includes the dot (e.g. ".fits")."""
+    return os.path.join(frame_dir(img_dir, name), f"{name}{ext}")
+
+
+def relative_path(name: str, ext: str) -> str:
+    """Path of one file of a frame relative to the image directory, with '/' separators as in URLs."""
+    partition = partition_of(name)
+    return f"{partition}/{name}{ext}" if partition else f"{name}{ext}"
+
+
+def _subdirs(path: str, digits: int) -> list[str]:
+    try:
+        with os.scandir(path) as entries:
+            return sorted(entry.name for entry in entries
+                          if entry.is_dir() and len(entry.name) == digits and entry.name.isdigit())
+    except FileNotFoundError:
+        return []
+
+
+def partitions(img_dir: str) -> Iterator[tuple[str, str]]:
+    """(relative, absolute) path of the root of the image directory and of every day partition, oldest first."""
+    yield "", img_dir
+    for year in _subdirs(img_dir, 4):
+        for month in _subdirs(os.path.join(img_dir, year), 2):
+            for day in _subdirs(os.path.join(img_dir, year, month), 2):
+                yield f"{year}/{month}/{day}", os.path.join(img_dir, year, month, day)
+
+
+def remove_empty(img_dir: str, partition: str) -> None:
+    """Remove a day partition and its parents once they are empty."""
+    path = os.path.join(img_dir, partition)
+    while partition:
+        try:
+            os.rmdir(path)
+        except OSError:
+            return      # not empty (or already gone)
+        partition = partition.rpartition("/")[0]
+        path = os.path.dirname(path)
+
+
+def migrate(img_dir: str) -> int:
+    """Move the frames at the root of the image directory into their partitions, returns how many files moved."""
+    with os.scandir(img_dir) as entries:
+        files = [entry.name for entry in entries if entry.is_file()]
+    moved = 0
+    for filename in files:
+        partition = partition_of(filename)
+        if not partition:
+            continue
+        target_dir = os.path.join(img_dir, partition)
+        os.makedirs(target_dir, exist_ok=True)
+        os.replace(os.path.join(img_dir, filename), os.path.join(target_dir, filename))
+        moved += 1
+    return moved
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Move a flat image directory into the YYYY/MM/DD layout")
+    parser.add_argument("img_dir", nargs="?", help="image directory, shared/img of $ALL_SKY_CAMERA by default")
+    args = parser.parse_args()
+
+    img_dir = args.img_dir
+    if img_dir is None:
+        if "ALL_SKY_CAMERA" not in os.environ:
+            parser.error("give the image directory or set ALL_SKY_CAMERA")
+        img_dir = os.path.join(os.environ["ALL_SKY_CAMERA"], "shared", "img")
+    print(f"{migrate(img_dir)} files moved into partitions of {img_dir}")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,47 @@
+import types
+import importlib
+from threading import Lock
+
+
+class LazyModule(types.ModuleType):
+    """
+    Stand-in for a module that is imported on the first access to one of its attributes.
+
+    numpy, cv2 and astropy take most of the start time of the server on a Raspberry Pi
+    while only the capture, the previews and the filters need them. The import runs
+    under a lock so that two threads touching the module first do not race.
+    """
+
+    def __init__(self, name: str) -> None:
+        super().__init__(name)
+        self._lock = Lock()
+        self._module = None
+
+    def _load(self) -> types.ModuleType:
+        with self._lock:
+            if self._module is None:
+                module = importlib.import_module(self.__name__)
+                # later lookups find the attributes directly, without going through __getattr__
+                self.__dict__.update({key: value for key, value in module.__dict__.items()
+                                      if key not in ("__name__", "__spec__", "__loader__")})
+                self._module = module
+        return self._module
+
+    def __getattr__(self, attr: str):
+        # only called for the attributes not copied yet
+        return getattr(self._load(), attr)
+
+    @property
+    def loaded(self) -> bool:
+        return self._module is not None
+
+
+def load(name: str) -> LazyModule:
+    """``np = lazy.load("numpy")`` in place of ``import numpy as np``."""
+    return LazyModule(name)
+
+
+def preload(*modules: LazyModule) -> None:
+    """Import the modules now, e.g. from a background thread before they are first needed."""
+    for module in modules:
+        module._load()
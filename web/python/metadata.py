@@ -0,0 +1,174 @@
+import sqlite3
+from threading import Lock
+from typing import Iterable, Optional
+
+
+class MetadataIndex:
+    """
+    On-disk index of the captured frames (one row per ``<name>.fits`` and its preview image).
+
+    The capture loop writes a row as soon as a frame is saved, so restarting the
+    server only needs to load this table and re-read the FITS headers of the files
+    whose mtime no longer matches the stored one.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS images (
+            name      TEXT PRIMARY KEY,
+            timestamp TEXT,
+            exposure  INTEGER,
+            gain      INTEGER,
+            offset    INTEGER,
+            tag       TEXT,
+            fits_size INTEGER,
+            png_size  INTEGER,
+            mtime     REAL
+        )
+    """
+    # every tag of a frame, the ``tag`` column above only keeps the one it was captured with
+    TAGS_SCHEMA = """
+        CREATE TABLE IF NOT EXISTS image_tags (
+            name TEXT,
+            tag  TEXT,
+            PRIMARY KEY (name, tag)
+        )
+    """
+    # streaks found by the meteor detector, the bounding box is in pixels of the frame
+    DETECTIONS_SCHEMA = """
+        CREATE TABLE IF NOT EXISTS detections (
+            name   TEXT,
+            x      INTEGER,
+            y      INTEGER,
+            width  INTEGER,
+            height INTEGER,
+            length REAL,
+            angle  REAL
+        )
+    """
+    DETECTION_FIELDS = ("x", "y", "width", "height", "length", "angle")
+    FIELDS = ("name", "timestamp", "exposure", "gain", "offset", "tag", "fits_size", "png_size", "mtime")
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = Lock()
+        # the connection is shared by the request handlers and the capture writers
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(self.SCHEMA)
+        has_tags = self._conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'image_tags'").fetchone()
+        self._conn.execute(self.TAGS_SCHEMA)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS image_tags_tag ON image_tags (tag)")
+        if not has_tags:
+            # index created before frames could have several tags
+            self._conn.execute("INSERT OR IGNORE INTO image_tags SELECT name, tag FROM images "
+                               "WHERE tag IS NOT NULL AND tag != 'none'")
+        self._conn.execute(self.DETECTIONS_SCHEMA)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS detections_name ON detections (name)")
+        self._conn.commit()
+
+    def load(self) -> dict[str, dict]:
+        with self._lock:
+            rows = self._conn.execute(f"SELECT {', '.join(self.FIELDS)} FROM images").fetchall()
+        return {row[0]: dict(zip(self.FIELDS, row)) for row in rows}
+
+    def upsert(self, name: str, spec: dict, tag: Optional[str], fits_size: int, png_size: int,
+               mtime: float) -> None:
+        self.upsert_many([(name, spec, tag, fits_size, png_size, mtime)])
+
+    def upsert_many(self, entries: Iterable[tuple]) -> None:
+        rows = [
+            (name, spec.get("timestamp"), spec.get("exposure"), spec.get("gain"), spec.get("offset"),
+             tag or 'none', fits_size, png_size, mtime)
+            for name, spec, tag, fits_size, png_size, mtime in entries
+        ]
+        if not rows:
+            return
+        with self._lock:
+            self._conn.executemany(
+                f"INSERT OR REPLACE INTO images ({', '.join(self.FIELDS)}) VALUES ({', '.join('?' * len(self.FIELDS))})",
+                rows
+            )
+            self._conn.executemany("INSERT OR IGNORE INTO image_tags (name, tag) VALUES (?, ?)",
+                                   [(row[0], row[5]) for row in rows if row[5] != 'none'])
+            self._conn.commit()
+
+    def load_tags(self) -> list[tuple[str, str]]:
+        """(name, tag) of every tag of every frame."""
+        with self._lock:
+            return self._conn.execute("SELECT name, tag FROM image_tags").fetchall()
+
+    def add_tags(self, names: Iterable[str], tag: str) -> None:
+        with self._lock:
+            self._conn.executemany("INSERT OR IGNORE INTO image_tags (name, tag) VALUES (?, ?)",
+                                   [(name, tag) for name in names])
+            self._conn.commit()
+
+    def remove_tags(self, names: Iterable[str], tag: str) -> None:
+        with self._lock:
+            self._conn.executemany("DELETE FROM image_tags WHERE name = ? AND tag = ?",
+                                   [(name, tag) for name in names])
+            self._conn.commit()
+
+    def add_detections(self, name: str, detections: Iterable[tuple]) -> None:
+        """detections: (x, y, width, height, length, angle) of the streaks of a frame, replacing the previous ones"""
+        with self._lock:
+            self._conn.execute("DELETE FROM detections WHERE name = ?", (name,))
+            self._conn.executemany(
+                f"INSERT INTO detections (name, {', '.join(self.DETECTION_FIELDS)}) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(name, *detection) for detection in detections]
+            )
+            self._conn.commit()
+
+    def detections(self, name: str) -> list[dict]:
+        with self._lock:
+            rows = self._conn.execute(f"SELECT {', '.join(self.DETECTION_FIELDS)} FROM detections WHERE name = ?",
+                                      (name,)).fetchall()
+        return [dict(zip(self.DETECTION_FIELDS, row)) for row in rows]
+
+    def detection_counts(self) -> dict[str, int]:
+        """Number of detections of every frame that has any."""
+        with self._lock:
+            return dict(self._conn.execute("SELECT name, COUNT(*) FROM detections GROUP BY name").fetchall())
+
+    def remove(self, names: Iterable[str]) -> None:
+        rows = [(name,) for name in names]
+        with self._lock:
+            self._conn.executemany("DELETE FROM images WHERE name = ?", rows)
+            self._conn.executemany("DELETE FROM image_tags WHERE name = ?", rows)
+            self._conn.executemany("DELETE FROM detections WHERE name = ?", rows)
+            self._conn.commit()
+
+    def average_frame_size(self) -> Optional[float]:
+        """Average bytes on disk per frame (FITS + PNG), None if nothing is indexed."""
+        with self._lock:
+            return self._conn.execute("SELECT AVG(fits_size + png_size) FROM images").fetchone()[0]
+
+    def total_size(self) -> int:
+        """Bytes on disk of every indexed frame (FITS + preview)."""
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(SUM(fits_size + png_size), 0) FROM images").fetchone()[0]
+
+    def oldest(self, limit: int, keep_tagged: bool = True, before: Optional[float] = None) -> list[tuple[str, int]]:
+        """
+        (name, bytes) of the oldest frames, by capture time (the name), at most ``limit``.
+
+        keep_tagged: skip the frames that have any tag
+        before: only the frames written before this time (epoch seconds)
+        """
+        conditions, params = [], []
+        if keep_tagged:
+            conditions.append("name NOT IN (SELECT name FROM image_tags)")
+        if before is not None:
+            conditions.append("mtime < ?")
+            params.append(before)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        with self._lock:
+            return self._conn.execute(
+                f"SELECT name, fits_size + png_size FROM images {where} ORDER BY name LIMIT ?", (*params, limit)
+            ).fetchall()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,145 @@
+"""
+Streaming detection of meteors (and other linear transients: satellites, planes) during a capture.
+
+Every frame is reduced ``scale`` times and compared with a running average of the
+previous ones, so the sky gradient, the stars and the hot pixels cancel out and only
+what changed since the last frames is left. The pixels well above the noise of the
+difference form a mask, and a probabilistic Hough transform on that mask keeps the
+straight streaks. At the default scale a 1920x1080 frame is handled in a few ms,
+so every frame of a sequence is checked as it is captured.
+"""
+from __future__ import annotations
+
+import math
+from threading import Lock
+from typing import NamedTuple, Optional
+
+import lazy
+
+np = lazy.load("numpy")
+cv2 = lazy.load("cv2")
+
+SCALE = 4               # reduction of the frame before the detection
+ALPHA = 0.1             # weight of a new frame in the running background
+SIGMA = 5.0             # threshold of the difference, in robust sigmas of its noise
+MIN_LENGTH = 20         # px of the reduced frame, shorter segments are noise or moving clouds
+MAX_GAP = 3             # px of the reduced frame bridged along a streak
+MAX_DETECTIONS = 10     # above this the frame changed as a whole (clouds, lights, exposure), not a streak
+
+
+class Detection(NamedTuple):
+    # bounding box in pixels of the full frame
+    x: int
+    y: int
+    width: int
+    height: int
+    length: float           # px of the full frame
+    angle: float            # degrees from the x axis, in [0, 180)
+
+    def to_dict(self) -> dict:
+        return self._asdict()
+
+
+class MeteorDetector:
+    """
+    Running background and detection of the frames of one capture sequence.
+
+    ``detect`` has to see the frames in capture order, so it is called by the capture thread
+    before a frame is queued for the writers. The background is not updated where something
+    was detected, so a slow satellite does not leave a trail in it.
+    """
+
+    def __init__(self, scale: int = SCALE, alpha: float = ALPHA, sigma: float = SIGMA,
+                 min_length: int = MIN_LENGTH, max_gap: int = MAX_GAP) -> None:
+        self.scale = scale
+        self.alpha = alpha
+        self.sigma = sigma
+        self.min_length = min_length
+        self.max_gap = max_gap
+        self._lock = Lock()
+        self._background: Optional[np.ndarray] = None
+        self.frames = 0
+        self.detections = 0
+
+    def reset(self) -> None:
+        with self._lock:
+            self._background = None
+
+    def _reduce(self, array: np.ndarray) -> np.ndarray:
+        height, width = array.shape
+        return cv2.resize(array, (width // self.scale, height // self.scale),
+                          interpolation=cv2.INTER_AREA).astype(np.float32)
+
+    def detect(self, array: np.ndarray) -> list[Detection]:
+        """Streaks of a frame that were not in the previous ones, the first frame only starts the background."""
+        small = self._reduce(array)
+        with self._lock:
+            self.frames += 1
+            background = self._background
+            if background is None or background.shape != small.shape:
+                self._background = small
+                return []
+            difference = small - background
+            sample = difference[::2, ::2]
+            noise = 1.4826 * float(np.median(np.abs(sample - np.median(sample))))
+            mask = (difference > self.sigma * max(noise, 1.0)).astype(np.uint8)
+            # the transient itself stays out of the background
+            cv2.accumulateWeighted(small, background, self.alpha, mask=1 - mask)
+
+        # closes the gaps of a faint streak broken up by the noise
+        mask = cv2.dilate(mask, None)
+        lines = cv2.HoughLinesP(mask * 255, 1, np.pi / 180, threshold=self.min_length // 2,
+                                minLineLength=self.min_length, maxLineGap=self.max_gap)
+        if lines is None:
+            return []
+        detections = self._merge(lines.reshape(-1, 4), array.shape)
+        if len(detections) > MAX_DETECTIONS:
+            return []
+        with self._lock:
+            self.detections += len(detections)
+        return detections
+
+    def _merge(self, segments: np.ndarray, shape: tuple[int, int]) -> list[Detection]:
+        # the Hough transform returns several pieces along a wide or broken streak, the collinear ones are one streak
+        streaks: list[list[int]] = []
+        for segment in segments.tolist():
+            for streak in streaks:
+                if self._same_streak(streak, segment):
+                    points = [streak[:2], streak[2:], segment[:2], segment[2:]]
+                    # the two points farthest apart are the ends of the merged streak
+                    first, last = max(((p, q) for p in points for q in points),
+                                      key=lambda pair: math.dist(pair[0], pair[1]))
+                    streak[:] = [*first, *last]
+                    break
+            else:
+                streaks.append(segment)
+
+        height, width = shape
+        detections = []
+        for x0, y0, x1, y1 in streaks:
+            # to the full frame, with one reduced pixel of margin around the streak
+            left, top = max((min(x0, x1) - 1) * self.scale, 0), max((min(y0, y1) - 1) * self.scale, 0)
+            right = min((max(x0, x1) + 2) * self.scale, width)
+            bottom = min((max(y0, y1) + 2) * self.scale, height)
+            detections.append(Detection(
+                left, top, right - left, bottom - top,
+                round(math.dist((x0, y0), (x1, y1)) * self.scale, 1),
+                round(math.degrees(math.atan2(y1 - y0, x1 - x0)) % 180, 1),
+            ))
+        return detections
+
+    def _same_streak(self, streak: list[int], segment: list[int]) -> bool:
+        x0, y0, x1, y1 = streak
+        length = math.dist((x0, y0), (x1, y1))
+        if length == 0:
+            return False
+        # both ends of the segment close to the line of the streak, and not beyond a gap from its ends
+        for x, y in (segment[:2], segment[2:]):
+            if abs((x1 - x0) * (y0 - y) - (x0 - x) * (y1 - y0)) / length > 2 * self.max_gap:
+                return False
+        along = [((x - x0) * (x1 - x0) + (y - y0) * (y1 - y0)) / length for x, y in (segment[:2], segment[2:])]
+        return max(along) >= -self.min_length and min(along) <= length + self.min_length
+
+    def status(self) -> dict:
+        with self._lock:
+            return {"frames": self.frames, "detections": self.detections, "scale": self.scale}
@@ -0,0 +1,99 @@
+from __future__ import annotations
+
+import time
+import queue
+import traceback
+from threading import Thread, Lock
+from typing import Callable, Optional
+
+import lazy
+
+np = lazy.load("numpy")
+
+
+class CapturePipeline:
+    """
+    Producer/consumer pipeline between the exposure thread and the disk.
+
+    The exposure thread hands every frame to ``submit`` and goes straight back to
+    the camera, a small pool of writer threads encodes and saves the frames in the
+    background. The queue is bounded, so when the writers fall behind ``submit``
+    blocks (backpressure) instead of letting the frames pile up in memory.
+    """
+
+    def __init__(self, save_frame: Callable[[np.ndarray, str, dict], None],
+                 workers: int = 2, max_depth: int = 4) -> None:
+        self.save_frame = save_frame
+        self.max_depth = max_depth
+        self._queue: queue.Queue = queue.Queue(maxsize=max_depth)
+        self._lock = Lock()
+
+        self.submitted = 0
+        self.written = 0
+        self.failed = 0
+        self.peak_depth = 0
+        self.blocked_time = 0.0     # seconds the producer spent waiting on a full queue
+
+        self._workers = [Thread(target=self._writer, daemon=True) for _ in range(workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def _writer(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                return
+            array, name, info = item
+            try:
+                self.save_frame(array, name, info)
+                with self._lock:
+                    self.written += 1
+            except Exception:
+                traceback.print_exc()
+                with self._lock:
+                    self.failed += 1
+            finally:
+                self._queue.task_done()
+
+    def submit(self, array: np.ndarray, name: str, info: dict,
+               should_stop: Optional[Callable[[], bool]] = None) -> bool:
+        """Queue a frame for writing, blocking while the queue is full.
+
+        Returns False if ``should_stop`` became true before the frame was queued.
+        """
+        wait_start = time.time()
+        while True:
+            try:
+                self._queue.put((array, name, dict(info)), timeout=0.1)
+                break
+            except queue.Full:
+                if should_stop is not None and should_stop():
+                    return False
+        with self._lock:
+            self.blocked_time += time.time() - wait_start
+            self.submitted += 1
+            self.peak_depth = max(self.peak_depth, self._queue.qsize())
+        return True
+
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                "depth": self._queue.qsize(),
+                "max_depth": self.max_depth,
+                "peak_depth": self.peak_depth,
+                "submitted": self.submitted,
+                "written": self.written,
+                "failed": self.failed,
+                "blocked_time": round(self.blocked_time, 3),
+            }
+
+    def close(self) -> None:
+        """Wait for every queued frame to be written and stop the writers."""
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
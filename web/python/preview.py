@@ -0,0 +1,35 @@
+from __future__ import annotations
+
+from threading import Lock
+from typing import Optional
+
+
+class LatestFrame:
+    """
+    Shared slot holding the preview of the newest captured frame.
+
+    The capture writers publish the preview they just wrote next to every frame, so
+    serving it is a memory read instead of sorting the image directory. ``seq``
+    increases with every frame and doubles as the ETag of the preview.
+    """
+
+    def __init__(self) -> None:
+        self._lock = Lock()
+        self.seq = 0
+        self.name: Optional[str] = None
+        self.image: Optional[bytes] = None
+
+    def publish(self, image: bytes, name: str) -> int:
+        """image: the encoded preview of the frame ``name``"""
+        with self._lock:
+            # the writers can finish out of order, never go back to an older frame
+            if self.name is not None and name < self.name:
+                return self.seq
+            self.seq += 1
+            self.name = name
+            self.image = image
+            return self.seq
+
+    def get(self) -> tuple[int, Optional[str], Optional[bytes]]:
+        with self._lock:
+            return self.seq, self.name, self.image
@@ -0,0 +1,157 @@
+from __future__ import annotations
+
+import os
+import time
+import multiprocessing
+from threading import Thread, Lock
+from typing import Callable, Optional
+
+import lazy
+from camera import Camera
+from stretch import PreviewEncoder
+
+fits = lazy.load("astropy.io.fits")
+
+
+def frame_fields(header: fits.Header) -> dict:
+    """Capture settings and tag of a frame from its FITS header, "unknown" when the header lacks them."""
+    tag = header.get("TAG", "none")
+    try:
+        return {
+            "exposure": header["EXPTIME"],
+            "gain": header["EGAIN"],
+            "offset": header["OFFSET"],
+            "timestamp": header["DATE-OBS"],
+            "tag": tag
+        }
+    except KeyError:
+        return {
+            "exposure": "unknown",
+            "gain": "unknown",
+            "offset": "unknown",
+            "timestamp": "unknown",
+            "tag": tag
+        }
+
+
+def recover_frame(task: tuple[str, str, Optional[PreviewEncoder]]) -> tuple[str, dict, Optional[str]]:
+    """
+    Open one FITS file: (name, header fields, path of the preview written or None).
+
+    Runs in the worker processes. The header is read in any case and the pixels are
+    only decoded when ``encoder`` is given, i.e. when the preview is missing.
+    """
+    name, fits_path, encoder = task
+    with fits.open(fits_path) as hdul:
+        hdu = Camera.image_hdu(hdul)
+        fields = frame_fields(hdu.header)
+        preview = encoder.write(hdu.data, os.path.splitext(fits_path)[0]) if encoder is not None else None
+    return name, fields, preview
+
+
+class StartupRecovery:
+    """
+    Re-reads the headers of the frames missing from the metadata index and re-encodes
+    the missing previews, in a pool of processes while the server already answers.
+
+    Every FITS file is opened once for both. The results are handed over in batches to
+    ``on_frames`` on the recovery thread, ``status`` reports the progress.
+    """
+
+    def __init__(self, encoder: PreviewEncoder,
+                 on_frames: Callable[[list[tuple[str, dict, Optional[str]]]], None],
+                 processes: Optional[int] = None, batch_size: int = 100) -> None:
+        self.encoder = encoder
+        self.on_frames = on_frames
+        self.processes = processes or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self._lock = Lock()
+        self._pool = None
+        self._thread = None
+        self.state = "idle"     # idle -> running -> done / failed
+        self.total = 0
+        self.done = 0
+        self.restored = 0
+        self.failed = 0
+        self.error: Optional[str] = None
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+
+    def start(self, frames: list[tuple[str, str, bool]]) -> None:
+        """
+        frames: (name, FITS path, preview missing) of the frames to recover
+
+        The worker processes are started here, call it before starting other threads
+        (where the platform forks them, they then inherit no held lock).
+        """
+        self.total = len(frames)
+        self.started = time.time()
+        if not frames:
+            self.state = "done"
+            self.finished = self.started
+            return
+        tasks = [(name, path, self.encoder if missing else None) for name, path, missing in frames]
+        # the default start method of the platform: fork is not available on Windows
+        self._pool = multiprocessing.get_context().Pool(min(self.processes, len(tasks)))
+        self.state = "running"
+        self._thread = Thread(target=self._run, args=(tasks,), daemon=True)
+        self._thread.start()
+
+    def _run(self, tasks: list) -> None:
+        chunksize = max(1, min(16, len(tasks) // (self.processes * 4)))
+        batch = []
+        try:
+            results = self._pool.imap_unordered(_recover_or_none, tasks, chunksize)
+            for result in results:
+                with self._lock:
+                    self.done += 1
+                    if result is None:
+                        self.failed += 1
+                        continue
+                    if result[2] is not None:
+                        self.restored += 1
+                batch.append(result)
+                if len(batch) >= self.batch_size:
+                    self.on_frames(batch)
+                    batch = []
+            if batch:
+                self.on_frames(batch)
+            self.state = "done"
+        except Exception as e:
+            self.error = str(e)
+            self.state = "failed"
+            print(f"Startup recovery failed: {e}")
+        finally:
+            self.finished = time.time()
+            self._pool.close()
+            self._pool.join()
+        print(f"Startup recovery: {self.done} frames read, {self.restored} previews restored, "
+              f"{self.failed} failed in {self.finished - self.started:.1f} s")
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                "state": self.state,
+                "total": self.total,
+                "done": self.done,
+                "restored": self.restored,
+                "failed": self.failed,
+                "error": self.error,
+                "processes": self.processes,
+                "elapsed": ((self.finished or time.time()) - self.started) if self.started else 0,
+            }
+
+    def stop(self) -> None:
+        if self._pool is not None and self.state == "running":
+            self._pool.terminate()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+
+def _recover_or_none(task: tuple) -> Optional[tuple[str, dict, Optional[str]]]:
+    # a broken file must not end the whole recovery
+    try:
+        return recover_frame(task)
+    except Exception as e:
+        print(f"Failed to recover {task[1]}: {e}")
+        return None
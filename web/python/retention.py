@@ -0,0 +1,117 @@
+import time
+import shutil
+from threading import Thread, Lock, Event
+from typing import Callable, Optional
+
+from metadata import MetadataIndex
+
+
+class RetentionManager:
+    """
+    Keeps the archive within its quota from a background thread.
+
+    Policies: ``max_bytes`` of frames on disk, ``max_age`` in seconds, and
+    ``keep_tagged`` to never evict a frame that has a tag. The oldest frames that
+    break a policy are removed in batches of ``batch_size``. The size of the archive
+    is read from the metadata index once and then tracked with ``added``/``removed``,
+    never by walking the image directory. Capture should check ``low_on_space``
+    before writing and wait while the disk is below ``min_free_bytes``.
+    """
+
+    def __init__(self, index: MetadataIndex, remove_frames: Callable[[list[str]], int], disk_path: str,
+                 max_bytes: Optional[int] = None, max_age: Optional[float] = None, keep_tagged: bool = True,
+                 min_free_bytes: int = 2 * 1024 ** 3, batch_size: int = 200, interval: float = 60.0) -> None:
+        """
+        remove_frames: deletes the frames with the given names everywhere, returns the bytes freed
+        disk_path: any path on the disk of the archive, for the free space
+        """
+        self.index = index
+        self.remove_frames = remove_frames
+        self.disk_path = disk_path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.keep_tagged = keep_tagged
+        self.min_free_bytes = min_free_bytes
+        self.batch_size = batch_size
+        self.interval = interval
+        self._lock = Lock()
+        self.total_bytes = index.total_size()
+        self.evicted_frames = 0
+        self.evicted_bytes = 0
+        self._wake = Event()
+        self._stop = Event()
+        self._thread = None
+
+    def added(self, nbytes: int) -> None:
+        with self._lock:
+            self.total_bytes += nbytes
+        if self.max_bytes is not None and self.total_bytes > self.max_bytes:
+            self._wake.set()
+
+    def removed(self, nbytes: int) -> None:
+        with self._lock:
+            self.total_bytes = max(self.total_bytes - nbytes, 0)
+
+    def free_bytes(self) -> int:
+        return shutil.disk_usage(self.disk_path).free
+
+    def low_on_space(self, next_write: float = 0) -> bool:
+        """True if writing ``next_write`` more bytes would leave less than ``min_free_bytes`` free."""
+        return self.free_bytes() - next_write < self.min_free_bytes
+
+    def wake(self) -> None:
+        self._wake.set()
+
+    def enforce(self) -> int:
+        """Evict until every policy holds, returns the number of frames removed."""
+        removed = 0
+        while self.max_bytes is not None and self.total_bytes > self.max_bytes:
+            batch = self.index.oldest(self.batch_size, self.keep_tagged)
+            if not batch:
+                break   # only tagged frames left
+            removed += self._evict(batch)
+        if self.max_age is not None:
+            cutoff = time.time() - self.max_age
+            while batch := self.index.oldest(self.batch_size, self.keep_tagged, before=cutoff):
+                removed += self._evict(batch)
+        return removed
+
+    def _evict(self, batch: list[tuple[str, int]]) -> int:
+        freed = self.remove_frames([name for name, _ in batch])
+        with self._lock:
+            self.evicted_frames += len(batch)
+            self.evicted_bytes += freed
+        return len(batch)
+
+    def status(self) -> dict:
+        return {
+            "total_bytes": self.total_bytes,
+            "free_bytes": self.free_bytes(),
+            "max_bytes": self.max_bytes,
+            "max_age": self.max_age,
+            "keep_tagged": self.keep_tagged,
+            "min_free_bytes": self.min_free_bytes,
+            "evicted_frames": self.evicted_frames,
+            "evicted_bytes": self.evicted_bytes,
+        }
+
+    def start(self) -> None:
+        def run():
+            while not self._stop.is_set():
+                try:
+                    removed = self.enforce()
+                    if removed:
+                        print(f"Retention: {removed} frames evicted")
+                except Exception as e:
+                    print(f"Retention failed: {e}")
+                self._wake.wait(self.interval)
+                self._wake.clear()
+
+        self._thread = Thread(target=run, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
@@ -0,0 +1,135 @@
+"""
+Cold start benchmark of the web server.
+
+    python3 startup_benchmark.py --runs 5 --output startup.json
+
+Every run starts a fresh interpreter: it times ``import web_server`` and lists the
+heavy modules (numpy, cv2, astropy, psutil) the import pulled in, then starts the
+server and polls it to time the first HTTP response, the camera becoming ready
+and the end of the startup recovery. The project of ``$ALL_SKY_CAMERA`` is used
+unless ``--project`` is given, with the emulated camera of ``web_server.py``.
+"""
+import os
+import sys
+import json
+import time
+import signal
+import platform
+import argparse
+import statistics
+import subprocess
+import urllib.error
+import urllib.request
+from typing import Optional
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+HEAVY_MODULES = ("numpy", "cv2", "astropy", "psutil")
+IMPORT_SCRIPT = f"""
+import sys, json, time
+start = time.perf_counter()
+import web_server
+seconds = time.perf_counter() - start
+print(json.dumps({{"seconds": seconds, "loaded": [m for m in {HEAVY_MODULES!r} if m in sys.modules]}}))
+"""
+
+
+def measure_import(env: dict) -> dict:
+    output = subprocess.run([sys.executable, "-c", IMPORT_SCRIPT], cwd=HERE, env=env,
+                            capture_output=True, text=True, check=True).stdout
+    # web_server prints the environment first, the result is the last line
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def get_json(url: str) -> Optional[dict]:
+    try:
+        with urllib.request.urlopen(url, timeout=1) as response:
+            return json.load(response)
+    except (urllib.error.URLError, ConnectionError, TimeoutError):
+        return None
+
+
+def measure_server(env: dict, port: int, timeout: float) -> dict:
+    base = f"http://127.0.0.1:{port}"
+    result = {"first_response": None, "camera_ready": None, "recovery_done": None, "camera_state": None}
+    start = time.perf_counter()
+    server = subprocess.Popen([sys.executable, os.path.join(HERE, "web_server.py")], cwd=HERE, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - start < timeout:
+            camera = get_json(f"{base}/get_camera_status")
+            now = time.perf_counter() - start
+            if camera is None:
+                if server.poll() is not None:
+                    raise RuntimeError(f"The server exited with {server.returncode}")
+                time.sleep(0.01)
+                continue
+            if result["first_response"] is None:
+                result["first_response"] = now
+            if result["camera_ready"] is None and camera["state"] != "connecting":
+                result["camera_ready"] = now
+                result["camera_state"] = camera["state"]
+            if result["recovery_done"] is None:
+                recovery = get_json(f"{base}/get_startup_status")
+                if recovery is not None and recovery["state"] in ("done", "failed"):
+                    result["recovery_done"] = time.perf_counter() - start
+            if result["camera_ready"] is not None and result["recovery_done"] is not None:
+                break
+            time.sleep(0.01)
+    finally:
+        server.send_signal(signal.SIGINT)
+        try:
+            server.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+    return result
+
+
+def summary(values: list) -> Optional[dict]:
+    values = [v for v in values if v is not None]
+    if not values:
+        return None
+    return {"median_ms": round(statistics.median(values) * 1000, 1), "min_ms": round(min(values) * 1000, 1),
+            "max_ms": round(max(values) * 1000, 1)}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the cold start of the web server")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--project", default=os.environ.get("ALL_SKY_CAMERA"), help="project path")
+    parser.add_argument("--port", type=int, default=8089, help="port of the server under test")
+    parser.add_argument("--timeout", type=float, default=120.0, help="seconds to wait for the server per run")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    args = parser.parse_args()
+    if args.project is None:
+        parser.error("give the project path or set ALL_SKY_CAMERA")
+    env = {**os.environ, "ALL_SKY_CAMERA": args.project, "ALL_SKY_PORT": str(args.port)}
+
+    runs = []
+    for i in range(args.runs):
+        imported = measure_import(env)
+        served = measure_server(env, args.port, args.timeout)
+        runs.append({"import": imported["seconds"], "loaded": imported["loaded"], **served})
+        print(f"run {i + 1}: import {imported['seconds'] * 1000:.0f} ms "
+              f"(loaded: {', '.join(imported['loaded']) or 'none'})  "
+              + "  ".join(f"{key} {served[key] * 1000:.0f} ms" if served[key] is not None else f"{key} -"
+                          for key in ("first_response", "camera_ready", "recovery_done")))
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "machine": platform.machine(),
+        "python": platform.python_version(),
+        "runs": runs,
+        **{key: summary([run[key] for run in runs])
+           for key in ("import", "first_response", "camera_ready", "recovery_done")},
+    }
+    for key in ("import", "first_response", "camera_ready", "recovery_done"):
+        if report[key]:
+            print(f"{key:>15}: median {report[key]['median_ms']} ms  "
+                  f"min {report[key]['min_ms']} ms  max {report[key]['max_ms']} ms")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
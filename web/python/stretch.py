@@ -0,0 +1,103 @@
+from __future__ import annotations
+
+from typing import Optional
+
+import lazy
+
+cv2 = lazy.load("cv2")
+np = lazy.load("numpy")
+
+# extensions of the preview images next to the FITS files, in lookup order
+PREVIEW_EXTENSIONS = (".jpg", ".webp", ".png")
+
+
+class PreviewEncoder:
+    """
+    16-bit frame to a stretched, downscaled 8-bit JPEG/WebP/PNG preview.
+
+    The black and white points are percentiles of a subsampled histogram, so a few hot
+    pixels or stars do not crush the stretch like a min/max normalization does, and the
+    asinh curve lifts the faint sky. The 16 to 8 bit mapping is a lookup table indexed
+    by the pixel values, built once per set of levels.
+    """
+
+    FORMATS = {"jpg": ".jpg", "webp": ".webp", "png": ".png"}
+    MIMETYPES = {"jpg": "image/jpeg", "webp": "image/webp", "png": "image/png"}
+
+    def __init__(self, fmt: str = "jpg", quality: int = 85, scale: float = 0.5, max_width: Optional[int] = None,
+                 low: float = 0.5, high: float = 99.95, asinh: float = 10.0, sample_step: int = 8) -> None:
+        """
+        low, high: percentiles mapped to black and white
+        asinh: strength of the asinh stretch, 0 for a linear one
+        sample_step: the histogram is computed on every ``sample_step``-th pixel of every ``sample_step``-th row
+        """
+        if fmt not in self.FORMATS:
+            raise ValueError(f"Unknown preview format {fmt}")
+        self.fmt = fmt
+        self.ext = self.FORMATS[fmt]
+        self.mimetype = self.MIMETYPES[fmt]
+        self.quality = quality
+        self.scale = scale
+        self.max_width = max_width
+        self.low = low
+        self.high = high
+        self.asinh = asinh
+        self.sample_step = sample_step
+        self._cached_lut: tuple = (None, None)     # (key, lut), swapped as a whole for the writer threads
+
+    def levels(self, array: np.ndarray) -> tuple[int, int]:
+        """Black and white points of the frame."""
+        sample = array[::self.sample_step, ::self.sample_step]
+        hist = np.bincount(sample.ravel(), minlength=256 if array.dtype == np.uint8 else 65536)
+        cdf = np.cumsum(hist)
+        low, high = np.searchsorted(cdf, cdf[-1] * np.array([self.low, self.high]) / 100)
+        return int(low), max(int(high), int(low) + 1)
+
+    def lut(self, low: int, high: int, size: int) -> np.ndarray:
+        key = (low, high, size)
+        cached_key, lut = self._cached_lut
+        if key != cached_key:
+            x = np.clip((np.arange(size, dtype=np.float32) - low) / (high - low), 0, 1)
+            if self.asinh > 0:
+                x = np.arcsinh(self.asinh * x) / np.arcsinh(self.asinh)
+            lut = (x * 255 + 0.5).astype(np.uint8)
+            self._cached_lut = (key, lut)
+        return lut
+
+    def stretch(self, array: np.ndarray) -> np.ndarray:
+        """Downscaled, stretched 8-bit image of the frame."""
+        if array.dtype not in (np.uint8, np.uint16):
+            array = np.clip(array, 0, 65535).astype(np.uint16)
+        height, width = array.shape
+        new_width = int(width * self.scale)
+        if self.max_width is not None:
+            new_width = min(new_width, self.max_width)
+        if new_width < width:
+            new_height = round(height * new_width / width)
+            array = cv2.resize(array, (new_width, new_height), interpolation=cv2.INTER_AREA)
+        low, high = self.levels(array)
+        return np.take(self.lut(low, high, 256 if array.dtype == np.uint8 else 65536), array)
+
+    def encode(self, array: np.ndarray) -> bytes:
+        image = self.stretch(array)
+        if self.fmt == "jpg":
+            params = [cv2.IMWRITE_JPEG_QUALITY, self.quality]
+        elif self.fmt == "webp":
+            params = [cv2.IMWRITE_WEBP_QUALITY, self.quality]
+        else:
+            params = [cv2.IMWRITE_PNG_COMPRESSION, 1]
+        ok, encoded = cv2.imencode(self.ext, image, params)
+        if not ok:
+            raise RuntimeError(f"Failed to encode the {self.fmt} preview")
+        return encoded.tobytes()
+
+    def write(self, array: np.ndarray, filename: str) -> str:
+        """Write the preview of the frame to ``filename`` + extension, returns its path."""
+        return self.save(self.encode(array), filename)
+
+    def save(self, preview: bytes, filename: str) -> str:
+        """Write a preview returned by ``encode`` to ``filename`` + extension, returns its path."""
+        path = f"{filename}{self.ext}"
+        with open(path, "wb") as f:
+            f.write(preview)
+        return path
@@ -0,0 +1,82 @@
+from threading import Lock
+from typing import Iterable
+
+
+class TagIndex:
+    """
+    In-memory inverted index of the frame tags: tag -> set of frames and frame -> set of tags.
+
+    A frame can have any number of tags. Adding, removing and looking up a tag is
+    O(1) per frame, so filtering by tag and deleting thousands of frames does not scan
+    any list. The tags are persisted by the metadata index (``image_tags`` table) and
+    loaded back with ``load``.
+    """
+
+    def __init__(self) -> None:
+        self._lock = Lock()
+        self._images: dict[str, set[str]] = {}     # tag -> names
+        self._tags: dict[str, set[str]] = {}       # name -> tags
+
+    def load(self, pairs: Iterable[tuple[str, str]]) -> None:
+        """Replace the index with the given (name, tag) pairs."""
+        images, tags = {}, {}
+        for name, tag in pairs:
+            images.setdefault(tag, set()).add(name)
+            tags.setdefault(name, set()).add(tag)
+        with self._lock:
+            self._images, self._tags = images, tags
+
+    def add(self, names: Iterable[str], tag: str) -> None:
+        with self._lock:
+            tagged = self._images.setdefault(tag, set())
+            for name in names:
+                tagged.add(name)
+                self._tags.setdefault(name, set()).add(tag)
+
+    def untag(self, names: Iterable[str], tag: str) -> None:
+        with self._lock:
+            tagged = self._images.get(tag)
+            if tagged is None:
+                return
+            for name in names:
+                tagged.discard(name)
+                name_tags = self._tags.get(name)
+                if name_tags is not None:
+                    name_tags.discard(tag)
+                    if not name_tags:
+                        del self._tags[name]
+            if not tagged:
+                del self._images[tag]
+
+    def discard(self, names: Iterable[str]) -> None:
+        """Forget deleted frames, touches only the tags of those frames."""
+        with self._lock:
+            for name in names:
+                for tag in self._tags.pop(name, ()):
+                    tagged = self._images[tag]
+                    tagged.discard(name)
+                    if not tagged:
+                        del self._images[tag]
+
+    def images(self, tag: str) -> frozenset[str]:
+        with self._lock:
+            return frozenset(self._images.get(tag, ()))
+
+    def tags_of(self, name: str) -> list[str]:
+        with self._lock:
+            return sorted(self._tags.get(name, ()))
+
+    def tags(self) -> list[str]:
+        """Every tag that has at least one frame."""
+        with self._lock:
+            return sorted(self._images)
+
+    def counts(self) -> dict[str, int]:
+        with self._lock:
+            return {tag: len(names) for tag, names in sorted(self._images.items())}
+
+    def __contains__(self, tag: str) -> bool:
+        return tag in self._images
+
+    def __len__(self) -> int:
+        return len(self._images)
@@ -0,0 +1,120 @@
+from __future__ import annotations
+
+import os
+from collections import OrderedDict
+from threading import Lock, get_ident
+from typing import Iterable, Optional, Sequence
+
+import layout
+import lazy
+
+cv2 = lazy.load("cv2")
+
+
+class ThumbnailStore:
+    """
+    Lazily generated, LRU evicted JPEG thumbnails of the gallery images.
+
+    Thumbnails are made from the half resolution preview written at capture time and
+    are kept in ``<cache_dir>/<size>/<name>.jpg`` until the cache exceeds
+    ``max_bytes``, at which point the least recently served ones are removed.
+    """
+
+    SIZES = {"small": 320, "medium": 800, "half": None}    # target width, None keeps the preview size
+
+    def __init__(self, img_dir: str, cache_dir: str, max_bytes: int, quality: int = 80,
+                 extensions: Sequence[str] = (".png",)) -> None:
+        self.img_dir = img_dir
+        self.extensions = tuple(extensions)
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.quality = quality
+        self._lock = Lock()
+        self._entries: OrderedDict[str, int] = OrderedDict()   # path -> size, least recently used first
+        self._total = 0
+
+        for size in self.SIZES:
+            os.makedirs(os.path.join(cache_dir, size), exist_ok=True)
+        self._load_existing()
+
+    def _load_existing(self) -> None:
+        files = []
+        for size in self.SIZES:
+            with os.scandir(os.path.join(self.cache_dir, size)) as entries:
+                for entry in entries:
+                    if entry.name.endswith('.jpg'):
+                        stat = entry.stat()
+                        files.append((stat.st_atime, entry.path, stat.st_size))
+        for _, path, nbytes in sorted(files):
+            self._entries[path] = nbytes
+            self._total += nbytes
+
+    def path_of(self, name: str, size: str) -> str:
+        return os.path.join(self.cache_dir, size, f"{name}.jpg")
+
+    def get(self, name: str, size: str) -> Optional[str]:
+        """Path of the thumbnail, generating it if needed. None if the source image is missing."""
+        if size not in self.SIZES:
+            raise ValueError(f"Unknown thumbnail size {size}")
+        path = self.path_of(name, size)
+        with self._lock:
+            if path in self._entries:
+                self._entries.move_to_end(path)
+                return path
+        if not self._generate(name, size, path):
+            return None
+        self._evict()
+        return path
+
+    def _generate(self, name: str, size: str, path: str) -> bool:
+        sources = [layout.frame_path(self.img_dir, name, ext) for ext in self.extensions]
+        source = next((source for source in sources if os.path.exists(source)), None)
+        image = cv2.imread(source, cv2.IMREAD_UNCHANGED) if source is not None else None
+        if image is None:
+            return False
+        width = self.SIZES[size]
+        if width is not None and image.shape[1] > width:
+            height = round(image.shape[0] * width / image.shape[1])
+            image = cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA)
+        ok, encoded = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        if not ok:
+            return False
+
+        # write next to the final file and rename, so a request never sees half a thumbnail
+        tmp_path = f"{path}.{get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(encoded.tobytes())
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._total += len(encoded) - self._entries.pop(path, 0)
+            self._entries[path] = len(encoded)
+        return True
+
+    def _evict(self) -> None:
+        with self._lock:
+            victims = []
+            while self._total > self.max_bytes and len(self._entries) > 1:
+                path, nbytes = self._entries.popitem(last=False)
+                self._total -= nbytes
+                victims.append(path)
+        for path in victims:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def discard(self, names: Iterable[str]) -> None:
+        """Remove the thumbnails of deleted images."""
+        for name in names:
+            for size in self.SIZES:
+                path = self.path_of(name, size)
+                with self._lock:
+                    nbytes = self._entries.pop(path, None)
+                    if nbytes is None:
+                        continue
+                    self._total -= nbytes
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
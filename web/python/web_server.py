@@ -1,15 +1,13 @@
 import os
 import sys
 import time
-import traceback
-import psutil
 import datetime
+import itertools
 import platform
-from typing import Iterable, Optional
-from threading import Thread, Event
+from typing import Iterable, Optional, Sequence
+from threading import Thread, Event, RLock
 
-from astropy.io import fits
-from flask import Flask, render_template, jsonify, request, Response
+from flask import Flask, render_template, jsonify, request, Response, send_file, abort, stream_with_context
 
 
 
@@ -21,16 +19,70 @@ try:
     import_path = os.path.join(PROJECT_PATH, "web", "python")
     sys.path.append(import_path)
     import camera
+    import pipeline
+    import metadata
+    import catalog
+    import filters
+    import thumbnails
+    import archive
+    import events
+    import preview
+    import metrics
+    import jobs
+    import stretch
+    import layout
+    import retention
+    import tagindex
+    import recovery
+    import lazy
+    import calibration
+    import hotpixels
+    import meteors
 except KeyError:
     raise RuntimeError("Please set the environment variable ALL_SKY_CAMERA to the project path !!!")
 
+psutil = lazy.load("psutil")
+
 # configure the Flask server
 static_folder = os.path.join(PROJECT_PATH, "shared")
 template_folder = os.path.join(PROJECT_PATH, "web", "html")
 app = Flask(__name__, static_folder=static_folder, template_folder=template_folder)
-scheduler: Optional[Thread] = None
-terminate_scheduler = Event()
+SERVER_PORT = int(os.environ.get("ALL_SKY_PORT", 8080))
 IMAGE_PER_PAGE = 8
+WRITER_THREADS = 2          # threads encoding and saving frames in the background
+CAPTURE_QUEUE_SIZE = 4      # frames waiting to be written before the exposure thread blocks
+THUMBNAIL_CACHE_SIZE = 512 * 1024 ** 2
+THUMBNAIL_MAX_AGE = 30 * 24 * 3600     # thumbnails of a frame never change, let the browser keep them
+RESOURCE_INTERVAL = 5       # seconds between two samples of the disk and memory usage
+PREVIEW_FORMAT = "jpg"      # jpg, webp or png, previews already on disk are read in any of them
+PREVIEW_QUALITY = 85
+# capture settings a request can set, the other keys of a job request describe the job itself
+SETTING_KEYS = ('gain', 'offset', 'exposure', 'interval', 'live', 'compression', 'calibrate', 'hot_pixels', 'meteors')
+JOB_KEYS = ('count', 'tag', 'start_at', 'stop_at', 'daily')
+preview_encoder = stretch.PreviewEncoder(PREVIEW_FORMAT, PREVIEW_QUALITY)
+RETENTION_MAX_BYTES: Optional[int] = None      # evict the oldest frames above this archive size
+RETENTION_MAX_AGE: Optional[float] = None      # evict the frames older than this, in seconds
+RETENTION_KEEP_TAGGED = True                   # tagged frames are never evicted
+MIN_FREE_BYTES = 2 * 1024 ** 3                 # capture pauses before the free space drops below this
+event_broadcaster = events.EventBroadcaster()
+latest_frame = preview.LatestFrame()
+camera_ready = Event()      # set once the camera is connected, or failed to
+# image_specs, the image catalog and the displaying list change together: the writer threads add frames,
+# the retention thread and the request handlers remove them
+frames_lock = RLock()
+specs_removals = 0          # bumped when frames leave image_specs, for the cached spec table
+
+metrics_registry = metrics.Registry()
+stage_seconds = metrics_registry.histogram(
+    "allsky_capture_stage_seconds", "Time spent in each stage of the capture pipeline", ["stage"])
+frames_captured = metrics_registry.counter("allsky_frames_captured_total", "Frames read from the camera")
+frames_written = metrics_registry.counter("allsky_frames_written_total", "Frames saved to disk")
+frames_dropped = metrics_registry.counter("allsky_frames_dropped_total", "Frames captured but not saved")
+bytes_written = metrics_registry.counter("allsky_bytes_written_total", "Bytes of FITS and preview files written")
+meteors_detected = metrics_registry.counter("allsky_meteors_detected_total", "Streaks found by the meteor detector")
+metrics_registry.gauge("allsky_capture_queue_depth", "Frames waiting for a writer",
+                       lambda: internal_states['pipeline'].depth() if internal_states['pipeline'] else 0)
+metrics_registry.gauge("allsky_bytes_per_frame", "Average bytes written per frame", lambda: frame_size_estimate())
 
 
 @app.route('/')
@@ -40,77 +92,59 @@ def index():
 
 @app.route('/gallery')
 def gallery():
-    internal_states['displaying_list'] = scan_images()
+    with frames_lock:
+        internal_states['displaying_list'] = scan_images()
     return render_template('gallery.html')
 
 
-def make_filters(cond: str) -> str:
-    if cond.lower() == "all":
-        return "True"
-    time_mask = {"ms": "*1000", "us": "*1", "s": "*1000000"}
-    field_mask = {"g": "gain", "o": "offset", "e": "exposure"}
-    conditions = cond.replace(" ", "").split(";")
-
-    condition_list = []
-    for condition in conditions:
-        for key, value in time_mask.items():
-            if key not in condition:
-                continue
-            condition = condition.replace(key, value)
-        for key, value in field_mask.items():
-            if key not in condition:
-                continue
-            condition = condition.replace(key, value)
-        condition_list.append(condition)
-
-    conditions = " and ".join(condition_list)
-    # filter out the images with unknown specs
-    return "'unknown' not in tstamp and " + conditions
+def spec_table() -> filters.SpecTable:
+    # image_specs grows during a capture and counts its removals,
+    # so its size and the removals are enough to tell if the columns are still current
+    with frames_lock:
+        key = (id(image_specs), specs_removals, len(image_specs))
+        if internal_states.get('spec_table_key') != key:
+            internal_states['spec_table'] = filters.SpecTable(image_specs)
+            internal_states['spec_table_key'] = key
+        return internal_states['spec_table']
 
 
 @app.route('/apply_filter/<string:tag>/<string:cond>')
 def apply_filter(tag: str, cond: str):
     if tag.lower() == 'all' and cond.lower() == 'all':
-        internal_states['displaying_list'] = scan_images()
+        with frames_lock:
+            internal_states['displaying_list'] = scan_images()
         internal_states['condition'] = ""
         return jsonify({"message": "Filter removed"})
 
-    existing_images = scan_images()
-
-    if tag.lower() == "all":
-        valid_images = existing_images
-    else:
-        valid_images = tags.get(tag, [])
-
-    def spec_of(image: str) -> list:
-        specs = image_specs.get(image, {})
-        ts = specs.get("timestamp", "unknown")
-        exp = int(specs.get("exposure", -1))
-        g = int(specs.get("gain", -1))
-        o = int(specs.get("offset", -1))
-        return [ts, exp, g, o]
-
-    filtered_images = []
     try:
-        print("valid images:", valid_images)
-        for i in valid_images:
-            tstamp, exposure, gain, offset = spec_of(i)
-            if eval(make_filters(cond)) and i in existing_images:
-                filtered_images.append(i)
-    except Exception as e:
-        traceback.print_exc()
+        predicate = filters.compile_filter(cond)
+    except filters.FilterSyntaxError as e:
+        print(f"Invalid filter condition: {e}")
         return jsonify({"message": "Invalid filter condition"})
 
-    print(filtered_images)
-
-    internal_states['displaying_list'] = filtered_images
+    valid_images = None if tag.lower() == "all" else tag_index.images(tag)
+    with frames_lock:
+        filtered_images = [
+            i for i in spec_table().select(predicate, valid_images)
+            if i in image_catalog
+        ]
+        internal_states['displaying_list'] = filtered_images or scan_images()
 
     if len(filtered_images) == 0:
-        internal_states['displaying_list'] = existing_images
         return jsonify({"message": "No images found !!! Displaying all images"})
     return jsonify({"message": f"Filter applied successfully {len(filtered_images)} images found"})
 
 
+@app.route('/thumbnail/<string:size>/<string:name>')
+def thumbnail(size: str, name: str):
+    if size not in thumbnail_store.SIZES or name not in image_catalog:
+        abort(404)
+    path = thumbnail_store.get(name, size)
+    if path is None:
+        abort(404)
+    return send_file(path, mimetype='image/jpeg', conditional=True, etag=True, max_age=THUMBNAIL_MAX_AGE)
+
+
 @app.route('/images/<int:page>')
 def images(page: int):
 
@@ -121,15 +155,15 @@ def images(page: int):
             for field in fields
         ]
 
-    img_w_specs = [
-        (f, *unpack_specs(f))
-        for f in internal_states['displaying_list']
-    ]
-
     page_start = page * IMAGE_PER_PAGE
     page_end = page_start + IMAGE_PER_PAGE
 
-    return jsonify(img_w_specs[page_start: page_end])
+    img_w_specs = [
+        (f, *unpack_specs(f), preview_file(f))
+        for f in internal_states['displaying_list'][page_start: page_end]
+    ]
+
+    return jsonify(img_w_specs)
 
 
 # @app.route('/download')
@@ -184,31 +218,34 @@ def images(page: int):
 @app.route('/download')
 def download_files():
     filenames = internal_states['displaying_list']
-    existing_files = set(scan_images())  # make sure the files are still there
-    filenames = [f for f in filenames if f in existing_files]
-    filenames = [f"{f}.{e}" for f in filenames for e in ["fits", "png"]]
-
-    # Debug: Print filenames to ensure they are correct
-    # print("Filenames to be downloaded:", filenames)
-
-    def generate():
-        for filename in filenames:
-            file_path = os.path.join(PROJECT_PATH, "shared", "img", filename)
-            # Debug: Check if the file exists
-            if not os.path.exists(file_path):
-                print(f"File not found: {file_path}")
-                continue
-            with open(file_path, 'rb') as f:
-                file_data = f.read()
-                name_bytes = filename.encode('utf-8')
-                yield len(name_bytes).to_bytes(1, 'little')
-                yield name_bytes
-                yield len(file_data).to_bytes(4, 'little')
-                yield file_data
-
-    response = Response(generate(), content_type='application/octet-stream')
-    response.headers['Content-Disposition'] = 'attachment; filename=image.bin'
-    return response
+    filenames = [f for f in filenames if f in image_catalog]  # make sure the files are still there
+    filenames = [name for f in filenames for name in (layout.relative_path(f, ".fits"), preview_file(f))
+                 if name is not None]
+
+    # the partition of a frame is known from its name, only the selected frames are looked up
+    img_dir = os.path.join(PROJECT_PATH, "shared", "img")
+    tar = archive.TarStream([(os.path.basename(filename), os.path.join(img_dir, filename)) for filename in filenames])
+
+    headers = {
+        'Content-Disposition': 'attachment; filename=images.tar',
+        'Accept-Ranges': 'bytes',
+        'ETag': f'"{tar.etag}"',
+    }
+    byte_range = archive.parse_range(request.headers.get('Range'), tar.size)
+    if_range = request.headers.get('If-Range')
+    if if_range is not None and if_range.strip('"') != tar.etag:
+        byte_range = None   # the selection changed since the partial download started, send everything
+
+    if byte_range is None:
+        headers['Content-Length'] = str(tar.size)
+        return Response(tar.iter_range(), status=200, headers=headers, content_type='application/x-tar')
+
+    start, end = byte_range
+    if start >= tar.size:
+        return Response(status=416, headers={'Content-Range': f'bytes */{tar.size}'})
+    headers['Content-Length'] = str(end - start + 1)
+    headers['Content-Range'] = f'bytes {start}-{end}/{tar.size}'
+    return Response(tar.iter_range(start, end), status=206, headers=headers, content_type='application/x-tar')
 
 # @app.route('/download')
 # def download():
@@ -302,40 +339,61 @@ def estimate_pagesize():
 
 @app.route('/delete_all_images/')
 def delete_images():
-    global tags, image_specs
-    ext = "fits;png".split(";")
+    with frames_lock:
+        present_list = internal_states['displaying_list']
+        intersect_list = [f for f in present_list if f in image_catalog]
+
+        remove_frames(intersect_list)
+        internal_states['displaying_list'] = scan_images()
 
-    existing_list = set(scan_images())
-    present_list = internal_states['displaying_list']
-    intersect_list = [f for f in present_list if f in existing_list]
+    return jsonify({'message': f'{len(intersect_list)} images deleted !!!'})
 
+
+def remove_frames(names: list[str]) -> int:
+    """
+    Delete the files of the frames and forget them everywhere, returns the bytes freed.
+
+    Called by the request handlers and by the retention thread, one at a time under ``frames_lock``.
+    """
+    with frames_lock:
+        return _remove_frames(names)
+
+
+def _remove_frames(names: list[str]) -> int:
+    global specs_removals
+    ext = ["fits"] + [e.lstrip(".") for e in stretch.PREVIEW_EXTENSIONS]
+
+    img_dir = os.path.join(PROJECT_PATH, "shared", "img")
     image_files = [
-        os.path.join(PROJECT_PATH, "shared", "img", f"{f}.{e}")
-        for f in intersect_list
+        layout.frame_path(img_dir, f, f".{e}")
+        for f in names
         for e in ext
     ]
 
+    freed = 0
     for filename in image_files:
         try:
+            size = os.path.getsize(filename)
             os.remove(filename)
+            freed += size
         except FileNotFoundError:
-            print(f"File not found: {filename}")
-
-    internal_states['displaying_list'] = scan_images()
-    for tag, img_timestamp in tags.items():
-        for i in img_timestamp:
-            if i not in internal_states['displaying_list']:
-                img_timestamp.remove(i)
-    # remove tags that has an empty list
-    tags = {tag: img_timestamp for tag, img_timestamp in tags.items() if img_timestamp}
-
-    image_specs = {
-        img_timestamp: spec
-        for img_timestamp, spec in image_specs.items()
-        if img_timestamp in internal_states['displaying_list']
-    }
+            pass    # a frame has a single preview format
+    for partition in {layout.partition_of(f) for f in names}:
+        layout.remove_empty(img_dir, partition)
+    metadata_index.remove(names)
+    image_catalog.discard(names)
+    thumbnail_store.discard(names)
+    tag_index.discard(names)
+    if retention_manager is not None:
+        retention_manager.removed(freed)
 
-    return jsonify({'message': f'{len(image_files) // 2} images deleted !!!'})
+    internal_states['displaying_list'] = [f for f in internal_states['displaying_list'] if f in image_catalog]
+
+    # in place, the writer threads keep adding to the same dict
+    for img in names:
+        image_specs.pop(img, None)
+    specs_removals += 1
+    return freed
 
 
 @app.route('/get_total_pages')
@@ -347,32 +405,75 @@ def get_total_pages():
 
 @app.route('/start_scheduler/<int:count>', methods=['POST'])
 def start_scheduler(count: int):
-    data = request.json
-    internal_states['settings'] = {key: int(value) for key, value in data.items()}
+    data = request.json or {}
+    try:
+        job = job_from_request({**data, 'count': count})
+        # the settings of the new sequence become the current ones
+        internal_states['settings'] = dict(job.settings)
+        job_manager.submit(job)
+    except ValueError:
+        return jsonify({'message': 'Invalid settings'}), 400
+
+    return jsonify({'message': 'Scheduler started successfully', 'job': job.id})
+
+
+@app.route('/add_job', methods=['POST'])
+def add_job():
+    """
+    Queue a capture sequence without waiting for it, e.g. every 30 s from dusk to dawn:
+    {"interval": 30, "start_at": "20:00", "stop_at": "06:00", "daily": true, "compression": "rice"}
+    Settings that are not given default to the current ones.
+    """
+    try:
+        job = job_manager.submit(job_from_request(request.json or {}))
+    except (ValueError, TypeError) as e:
+        return jsonify({'message': f'Invalid job: {e}'}), 400
+    event_broadcaster.publish('jobs', [queued.to_dict() for queued in job_manager.jobs()])
+    return jsonify({'message': 'Job queued', 'job': job.to_dict()})
 
-    create_task(count)
 
-    return jsonify({'message': 'Scheduler started successfully'})
+@app.route('/get_jobs')
+def get_jobs():
+    return jsonify([job.to_dict() for job in job_manager.jobs()])
+
+
+@app.route('/get_job/<job_id>')
+def get_job(job_id: str):
+    job = job_manager.get(job_id)
+    if job is None:
+        abort(404)
+    return jsonify(job.to_dict())
+
+
+@app.route('/cancel_job/<job_id>', methods=['POST'])
+def cancel_job(job_id: str):
+    if not job_manager.cancel(job_id):
+        abort(404)
+    event_broadcaster.publish('jobs', [queued.to_dict() for queued in job_manager.jobs()])
+    return jsonify({'message': 'Job cancelled'})
 
 
 @app.route('/stop_scheduler')
 def stop_scheduler():
-    global scheduler
-    if scheduler is not None:
-        terminate_scheduler.set()
-        scheduler.join()
-        scheduler = None
+    # returns right away, the capture thread stops after the current frame
+    job_manager.cancel_all()
+    event_broadcaster.publish('jobs', [queued.to_dict() for queued in job_manager.jobs()])
     return jsonify({'message': 'Scheduler stopped successfully'})
 
 
 @app.route('/get_scheduler_status')
 def get_scheduler_status():
-    return jsonify({'running': "r" if scheduler else "i"})
+    job = job_manager.current()
+    return jsonify({'running': "r" if job else "i", 'job': job.id if job else None})
 
 
 @app.route('/get_progress')
 def get_progress():
-    return jsonify({'eta': internal_states['eta']})
+    capture_pipeline = internal_states['pipeline']
+    queue_status = capture_pipeline.status() if capture_pipeline else None
+    job = job_manager.current()
+    return jsonify({'eta': job.eta if job else "", 'job': job.to_dict() if job else None,
+                    'exposure': cam.exposure_progress() if cam else None, 'queue': queue_status})
 
 
 @app.route('/get_settings')
@@ -382,17 +483,25 @@ def get_settings():
 
 @app.route('/get_preview_images')
 def get_preview_images():
-    img_loc = os.path.join(PROJECT_PATH, "shared", "img")
-    image_list = sorted(os.listdir(img_loc))
-    image_list.reverse()
-    if len(image_list) == 1:
+    seq, name, _ = latest_frame.get()
+    if name is not None:
+        return jsonify({"img_name": layout.relative_path(name, preview_encoder.ext), "seq": seq})
+    # nothing captured since the server started, fall back to the newest image on disk
+    existing_images = scan_images()
+    if not existing_images:
         return jsonify({"img_name": "NONE"})
-    while not image_list[0].endswith('.png'):
-        if len(image_list) == 1:
-            return jsonify({"img_name": "NONE"})
-        image_list.pop(0)
+    return jsonify({"img_name": preview_file(existing_images[-1]) or "NONE"})
+
 
-    return jsonify({"img_name": image_list[0]})
+@app.route('/preview')
+def preview_image():
+    seq, _, image = latest_frame.get()
+    if image is None:
+        abort(404)
+    etag = f'"{seq}"'
+    if request.headers.get('If-None-Match') == etag:
+        return Response(status=304, headers={'ETag': etag})
+    return Response(image, mimetype=preview_encoder.mimetype, headers={'ETag': etag, 'Cache-Control': 'no-cache'})
 
 
 @app.route('/add_tag/<string:tag_name>')
@@ -410,37 +519,131 @@ def stop_tagging():
 
 @app.route('/get_tags')
 def get_tags():
-    global tags
-    existing_files = scan_images()
-    filtered_tags = {}
-    for tag_name, image_timestamp_list in tags.items():
-        for image_timestamp in image_timestamp_list:
-            if any(image_timestamp in f for f in existing_files):
-                filtered_tags[tag_name] = image_timestamp_list
-                break
-    tags = filtered_tags
-    data = {'tags': list(tags.keys())}
+    data = {'tags': tag_index.tags(), 'counts': tag_index.counts()}
     return jsonify(data)
 
 
+@app.route('/get_image_tags/<string:name>')
+def get_image_tags(name: str):
+    if name not in image_catalog:
+        abort(404)
+    return jsonify({'name': name, 'tags': tag_index.tags_of(name)})
+
+
+def tag_request() -> tuple[list[str], str]:
+    data = request.get_json(silent=True) or {}
+    tag = str(data.get('tag', '')).strip()
+    if not tag or tag.lower() in ('all', 'none'):
+        raise ValueError(f"Invalid tag name {tag!r}")
+    names = data.get('names')
+    if names is None:
+        names = internal_states['displaying_list']     # the frames shown in the gallery
+    return [name for name in names if name in image_catalog], tag
+
+
+@app.route('/tag_images', methods=['POST'])
+def tag_images():
+    try:
+        names, tag = tag_request()
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    metadata_index.add_tags(names, tag)
+    tag_index.add(names, tag)
+    return jsonify({'message': f'{len(names)} images tagged {tag}'})
+
+
+@app.route('/untag_images', methods=['POST'])
+def untag_images():
+    try:
+        names, tag = tag_request()
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    metadata_index.remove_tags(names, tag)
+    tag_index.untag(names, tag)
+    return jsonify({'message': f'Tag {tag} removed from {len(names)} images'})
+
+
 @app.route('/get_current_tag')
 def get_current_tag():
     ctag = internal_states['current_tag'] or 'none'
     return jsonify({'tag': internal_states['current_tag']})
 
 
+@app.route('/events')
+def server_events():
+    response = Response(stream_with_context(event_broadcaster.subscribe()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def watch_resources():
+    # one sampler for every client, the broadcaster only forwards the values that changed
+    while True:
+        try:
+            event_broadcaster.publish('resources', resource_info())
+        except Exception as e:
+            print(f"Failed to sample resources: {e}")
+        time.sleep(RESOURCE_INTERVAL)
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics_registry.render(), content_type=metrics.Registry.CONTENT_TYPE)
+
+
+def frame_size_estimate() -> float:
+    # measured on the frames written since the server started, or the frames already on disk
+    if frames := frames_written.value():
+        return bytes_written.value() / frames
+    if internal_states.get('indexed_frame_size') is None:
+        internal_states['indexed_frame_size'] = metadata_index.average_frame_size() or 0
+    return internal_states['indexed_frame_size']
+
+
 @app.route('/resources')
 def resources():
+    return jsonify(resource_info())
+
+
+@app.route('/get_retention')
+def get_retention():
+    return jsonify(retention_manager.status())
+
+
+@app.route('/set_retention', methods=['POST'])
+def set_retention():
+    """Change the retention policies: {"max_bytes": ..., "max_age": seconds, "keep_tagged": ..., "min_free_bytes": ...}"""
+    data = request.json or {}
+    try:
+        for key in ("max_bytes", "max_age", "min_free_bytes"):
+            if key in data:
+                value = None if data[key] in (None, "") else float(data[key])
+                if key == "min_free_bytes" and value is None:
+                    raise ValueError("min_free_bytes is required")
+                setattr(retention_manager, key, value)
+        if "keep_tagged" in data:
+            retention_manager.keep_tagged = bool(data["keep_tagged"])
+    except (TypeError, ValueError) as e:
+        return jsonify({'message': f'Invalid retention policy: {e}'}), 400
+    retention_manager.wake()
+    return jsonify(retention_manager.status())
+
+
+def resource_info() -> dict:
     if os.name == 'nt' or platform.system() == 'Windows':
         disk_usage = psutil.disk_usage('C:')
     else:
         disk_usage = psutil.disk_usage('/')
     disk_info = f"Disk: {disk_usage.used // 1024**3} GB / {disk_usage.total // 1024**3} GB"
-    estimated_pictures = int(disk_usage.free // (18.4 * 1024 ** 2))
+    frame_size = frame_size_estimate() or 18.4 * 1024 ** 2   # rough size of a 1080p frame until one is written
+    estimated_pictures = int(disk_usage.free // frame_size)
     disk_info += f"\nFree: {disk_usage.free // 1024 ** 3}GB - (~{estimated_pictures} pictures)"
+    if retention_manager is not None:
+        disk_info += f"\nArchive: {retention_manager.total_bytes / 1024 ** 3:.1f} GB"
     memory = psutil.virtual_memory()
     memory_info = f"Memory: {memory.used // 1024**2} MB / {memory.total // 1024**2} MB"
-    return jsonify({"disk": disk_info, "memory": memory_info})
+    return {"disk": disk_info, "memory": memory_info}
 
 
 def timestamp():
@@ -452,66 +655,361 @@ def timestamp():
         return cur_time_str.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3]
 
 
-def create_task(repeat: int) -> Response:
-    global scheduler
-    if scheduler is not None:
-        return jsonify({'message': 'Scheduler already running'})
-    terminate_scheduler.clear()
-
-    try:    # get the settings from the internal states
-        gain = int(internal_states['settings']['gain'])
-        offset = int(internal_states['settings']['offset'])
-        exposure = int(internal_states['settings']['exposure'])
-        interval = int(internal_states['settings']['interval'])
-    except ValueError:
-        return jsonify({'message': 'Invalid settings'})
-    except Exception:
-        return jsonify({'message': 'Unknown error'})
+def connect_camera() -> None:
+    # runs on its own thread: the server answers while the SDK connects to the camera
+    global cam
+    start = time.perf_counter()
+    internal_states['camera'] = {'state': 'connecting', 'error': None, 'seconds': None}
+    try:
+        cam = camera.Camera(PROJECT_PATH, EMULATE)
+        # the first frame does not pay for the imports of the FITS writer and the preview encoder
+        lazy.preload(camera.fits, stretch.cv2)
+        state, error = 'ready', None
+    except Exception as e:
+        print(f"Failed to initialize the camera: {e}")
+        state, error = 'failed', str(e)
+    internal_states['camera'] = {'state': state, 'error': error, 'seconds': time.perf_counter() - start}
+    camera_ready.set()
+    event_broadcaster.publish('camera', internal_states['camera'])
+
+
+@app.route('/get_camera_status')
+def get_camera_status():
+    return jsonify(internal_states['camera'])
+
+
+def wait_for_camera(job: jobs.Job) -> bool:
+    # False if the job is stopped before the camera is ready
+    if not camera_ready.is_set():
+        job.eta = "Waiting for the camera"
+        publish_progress()
+        while not camera_ready.wait(0.1):
+            if job.should_stop():
+                return False
+    if cam is None:
+        raise RuntimeError(f"Camera not available: {internal_states['camera']['error']}")
+    return True
+
+
+def run_capture(job: jobs.Job) -> None:
+    # runs on the capture thread of the job manager, the only thread that talks to the camera
+    if not wait_for_camera(job):
+        return
+    if job.settings.get('calibration'):
+        run_calibration(job)
+        return
+    gain = int(job.settings['gain'])
+    offset = int(job.settings['offset'])
+    exposure = int(job.settings['exposure'])
+    interval = int(job.settings['interval'])
+    live = bool(int(job.settings.get('live', 0)))
+    compression = job.settings.get('compression', 'none')
+    calibrate = bool(int(job.settings.get('calibrate', 0)))
+    correct_hot_pixels = bool(int(job.settings.get('hot_pixels', 0)))
+    # one background per sequence, its frames share the exposure settings
+    meteor_detector = meteors.MeteorDetector() if int(job.settings.get('meteors', 0)) else None
     fits_header = {
         "exposure": f"{exposure / 1e6:.1f}",
         "gain": gain,
         "offset": offset,
         "timestamp": timestamp(),
-        "tag": internal_states['current_tag'] or 'none'
+        "tag": job.tag or internal_states['current_tag'] or 'none'
     }
 
-    def event_loop():
-        total_time, timer = time.time(), time.time()
-        for i in range(repeat):
+    def save_frame(array, filename: str, info: dict) -> None:
+        # runs on the writer threads of the capture pipeline
+        time_stamp = info["timestamp"]
+        try:
+            if correct_hot_pixels:
+                # the detector needs the raw frame, before the calibration and the correction
+                with stage_seconds.time(stage="hot_pixel_detect"):
+                    hot_pixels.observe(array)
+            if calibrate:
+                with stage_seconds.time(stage="calibrate"):
+                    applied = calibration_library.apply(array, exposure, gain, offset,
+                                                        temperature=info.get("temperature"))
+                info["calibration"] = ",".join(applied) or "none"
+            if correct_hot_pixels:
+                with stage_seconds.time(stage="hot_pixels"):
+                    info["hot_pixels"] = hot_pixels.correct(array)
+            found = info.get("detections", [])
+            with stage_seconds.time(stage="fits_write"):
+                # created here rather than at the exposure: a removal in between drops the empty day directory
+                os.makedirs(os.path.dirname(filename), exist_ok=True)
+                cam.array_to_fits(array, filename, info, compression)
+            with stage_seconds.time(stage="preview_encode"):
+                encoded = preview_encoder.encode(array)
+                preview_encoder.save(encoded, filename)
+            with stage_seconds.time(stage="preview"):
+                # the same preview is served live, the frame is stretched and encoded once
+                seq = latest_frame.publish(encoded, time_stamp)
+        except Exception:
+            frames_dropped.inc()
+            raise
+        finally:
+            # the frame buffer can be reused by the next exposure
+            cam.release(array)
+        index_start = time.perf_counter()
+        spec = {
+            "timestamp": time_stamp, "exposure": exposure, "gain": gain, "offset": offset, "meteors": len(found)
+        }
+        curr_tag = info["tag"]
+        entry = index_entry(time_stamp, spec, curr_tag)
+        metadata_index.upsert(*entry)
+        if found:
+            metadata_index.add_detections(time_stamp, found)
+        with frames_lock:
+            image_specs[time_stamp] = spec
+            image_catalog.add(time_stamp)
+        if curr_tag != 'none':
+            tag_index.add([time_stamp], curr_tag)
+        stage_seconds.observe(time.perf_counter() - index_start, stage="index_update")
+        frames_written.inc()
+        bytes_written.inc(entry[3] + entry[4])
+        retention_manager.added(entry[3] + entry[4])
+        event_broadcaster.publish('frame', {'img_name': layout.relative_path(time_stamp, preview_encoder.ext),
+                                            'seq': seq})
+        if found:
+            meteors_detected.inc(len(found))
+            print(f"{len(found)} meteor(s) in {time_stamp}")
+            event_broadcaster.publish('meteor', {'name': time_stamp,
+                                                 'img_name': layout.relative_path(time_stamp, preview_encoder.ext),
+                                                 'detections': [detection.to_dict() for detection in found]})
+        publish_progress()
+
+    def exposures():
+        if live:
+            # back to back frames from the camera's live mode, the interval does not apply;
+            # the ring has to outlast every frame still waiting in or being written by the pipeline
+            ring_size = CAPTURE_QUEUE_SIZE + WRITER_THREADS + 2
+            yield from cam.stream(exposure, gain=gain, offset=offset, ring_size=ring_size,
+                                  should_stop=job.should_stop)
+            return
+        timer = time.time()
+        while True:
             while time.time() - timer < interval:
-                if terminate_scheduler.is_set():
+                if job.should_stop():
                     return
                 time.sleep(0.1)
-            if terminate_scheduler.is_set():
+            if job.should_stop():
                 return
             timer = time.time()
             print("Exposing ...")
-            array, _ = cam.expose(exposure, gain=gain, offset=offset)
-            time_stamp = timestamp()
-            filename = os.path.join(PROJECT_PATH, "shared", "img", time_stamp)
-            fits_header["timestamp"] = time_stamp
-            cam.array_to_fits(array, filename, fits_header)
-            cam.array_to_png(array, filename)
-            image_specs[time_stamp] = {
-                "timestamp": time_stamp, "exposure": exposure, "gain": gain, "offset": offset
-            }
-            progress_str = f"{i+1}/{repeat}"
-            time_elapsed = time.time() - total_time
-            elapsed_str = f"{int(time_elapsed // 60)}m {int(time_elapsed % 60)}s"
-            eta = (time.time() - total_time) / (i + 1) * (repeat - i - 1)
-            eta_str = f"{int(eta // 60)}m {int(eta % 60)}s"
-            internal_states['eta'] = f"{progress_str} - {elapsed_str}/{eta_str}"
-            if curr_tag := internal_states['current_tag']:
-                if tags.get(curr_tag):
-                    tags[curr_tag].append(time_stamp)
-                else:
-                    tags[curr_tag] = [time_stamp]
-
-    scheduler = Thread(target=event_loop)
-    scheduler.start()
-    scheduler.join()
-    print("Scheduler finished")
-    scheduler = None
+            try:
+                yield cam.expose(exposure, gain=gain, offset=offset, should_stop=job.should_stop,
+                                 progress=publish_progress)
+            except camera.ExposureCancelled:
+                return
+
+    def capture(frames: pipeline.CapturePipeline):
+        total_time = time.time()
+        frame_source = exposures()
+        try:
+            for i, (array, _) in zip(itertools.count(), frame_source):
+                frames_captured.inc()
+                # measured by the camera, the live mode only knows the readout
+                for stage, seconds in cam.last_timings.items():
+                    stage_seconds.observe(seconds, stage=stage)
+                if not wait_for_disk_space() or not store(frames, i, array, total_time):
+                    frames_dropped.inc()
+                    return
+                if job.count is not None and i + 1 >= job.count:
+                    return
+        finally:
+            # stops the live stream if it is still running
+            frame_source.close()
+
+    def wait_for_disk_space() -> bool:
+        # the frame is kept until there is room for it, False if the job is stopped meanwhile
+        if not retention_manager.low_on_space(frame_size_estimate()):
+            return True
+        print("Capture paused, low disk space")
+        job.eta = "Paused, low disk space"
+        event_broadcaster.publish('retention', retention_manager.status())
+        publish_progress()
+        retention_manager.wake()   # an archive above its quota frees space
+        while retention_manager.low_on_space(frame_size_estimate()):
+            if job.should_stop():
+                return False
+            time.sleep(1)
+        print("Capture resumed")
+        return True
+
+    def store(frames: pipeline.CapturePipeline, i: int, array, total_time: float) -> bool:
+        time_stamp = timestamp()
+        filename = os.path.join(layout.frame_dir(os.path.join(PROJECT_PATH, "shared", "img"), time_stamp), time_stamp)
+        fits_header["timestamp"] = time_stamp
+        fits_header["tag"] = job.tag or internal_states['current_tag'] or 'none'
+        fits_header["temperature"] = cam.temperature()
+        if meteor_detector is not None:
+            # here rather than on the writer threads: the running background needs the frames in
+            # capture order; the raw frame will do, the difference cancels the dark and the hot pixels
+            with stage_seconds.time(stage="meteors"):
+                found = meteor_detector.detect(array)
+            fits_header["meteors"] = len(found)
+            fits_header["detections"] = found
+        if not frames.submit(array, filename, fits_header, job.cancelled.is_set):
+            return False
+        job.done = i + 1
+        time_elapsed = time.time() - total_time
+        elapsed_str = f"{int(time_elapsed // 60)}m {int(time_elapsed % 60)}s"
+        if job.count is not None:
+            progress_str = f"{i+1}/{job.count}"
+            eta = time_elapsed / (i + 1) * (job.count - i - 1)
+        else:
+            # open ended sequence, runs until its stop time
+            progress_str = f"{i+1}"
+            eta = max(job.stop_at - time.time(), 0)
+        eta_str = f"{int(eta // 60)}m {int(eta % 60)}s"
+        job.eta = f"{progress_str} - {elapsed_str}/{eta_str}"
+        publish_progress()
+        return True
+
+    capture_pipeline = pipeline.CapturePipeline(save_frame, workers=WRITER_THREADS, max_depth=CAPTURE_QUEUE_SIZE)
+    internal_states['pipeline'] = capture_pipeline
+    try:
+        capture(capture_pipeline)
+    finally:
+        # let the writers flush the frames that are still queued
+        capture_pipeline.close()
+    print("Job finished")
+
+
+def run_calibration(job: jobs.Job) -> None:
+    # a series of bias, dark or flat frames, combined into a master of the calibration library
+    kind = job.settings['calibration']
+    gain = int(job.settings['gain'])
+    offset = int(job.settings['offset'])
+    exposure = calibration.BIAS_EXPOSURE if kind == 'bias' else int(job.settings['exposure'])
+    if cam.emulate:
+        cam.emulator.covered = kind in ('bias', 'dark')     # the lens cap of the emulated camera
+    series = None
+    try:
+        for i in range(job.count):
+            print(f"Exposing {kind} ...")
+            try:
+                array, _ = cam.expose(exposure, gain=gain, offset=offset, should_stop=job.should_stop,
+                                      progress=publish_progress)
+            except camera.ExposureCancelled:
+                return
+            try:
+                temperature = cam.temperature()
+                if series is None:
+                    series = calibration_library.series(kind, job.count, array.shape, exposure, gain, offset,
+                                                        temperature=temperature)
+                series.add(array, temperature)
+            finally:
+                cam.release(array)
+            job.done = i + 1
+            job.eta = f"{kind} {i + 1}/{job.count}"
+            publish_progress()
+            if job.should_stop():
+                return
+        job.eta = f"Combining {series.frames} {kind} frames"
+        publish_progress()
+        built, series = series, None
+        key = calibration_library.build(built)
+        print(f"Calibration master {key.filename()} built from {built.frames} frames")
+        if key.kind == 'dark':
+            hot_pixels.from_dark(calibration_library.master(key))
+        event_broadcaster.publish('calibration', calibration_library.masters())
+    finally:
+        if cam.emulate:
+            cam.emulator.covered = False
+        if series is not None:
+            series.close()
+
+
+@app.route('/capture_calibration', methods=['POST'])
+def capture_calibration():
+    """
+    Queue a calibration series, e.g. {"kind": "dark", "count": 30, "exposure": 10000000, "gain": 150}
+    Settings that are not given default to the current ones, bias frames use the shortest exposure.
+    """
+    data = request.json or {}
+    try:
+        if data.get('kind') not in calibration.KINDS:
+            raise ValueError(f"unknown calibration frame {data.get('kind')}")
+        settings = parse_settings({key: value for key, value in data.items() if key in ('exposure', 'gain', 'offset')},
+                                  internal_states['settings'])
+        settings['calibration'] = data['kind']
+        count = int(data.get('count', 20))
+        if count < 1:
+            raise ValueError("a series needs at least one frame")
+        job = job_manager.submit(jobs.Job(settings, count))
+    except (ValueError, TypeError) as e:
+        return jsonify({'message': f'Invalid calibration series: {e}'}), 400
+    event_broadcaster.publish('jobs', [queued.to_dict() for queued in job_manager.jobs()])
+    return jsonify({'message': 'Calibration series queued', 'job': job.to_dict()})
+
+
+@app.route('/get_calibration')
+def get_calibration():
+    return jsonify({'masters': calibration_library.masters(), 'temperature': cam.temperature() if cam else None,
+                    'hot_pixels': hot_pixels.status()})
+
+
+@app.route('/delete_calibration/<string:name>', methods=['POST'])
+def delete_calibration(name: str):
+    if not calibration_library.remove(name):
+        abort(404)
+    return jsonify({'message': f'{name} deleted'})
+
+
+@app.route('/get_detections/<string:name>')
+def get_detections(name: str):
+    # bounding boxes of the streaks of a frame, in pixels of the FITS image
+    return jsonify(metadata_index.detections(name))
+
+
+@app.route('/delete_hot_pixels', methods=['POST'])
+def delete_hot_pixels():
+    # the rolling detector builds a new map from the next frames
+    hot_pixels.clear()
+    return jsonify({'message': 'Hot pixel map deleted'})
+
+
+def job_changed(job: Optional[jobs.Job]) -> None:
+    # called by the job manager when a job starts (job) and when it ends (None)
+    event_broadcaster.publish('scheduler', {'running': "r" if job else "i", 'job': job.id if job else None})
+    event_broadcaster.publish('jobs', [queued.to_dict() for queued in job_manager.jobs()])
+    publish_progress()
+
+
+def job_from_request(data: dict, count: Optional[int] = None) -> jobs.Job:
+    settings = parse_settings({key: value for key, value in data.items() if key not in JOB_KEYS},
+                              internal_states['settings'])
+    if data.get('count') not in (None, ""):
+        count = int(data['count'])
+    # a stop time before the start time is on the next day (dusk to dawn)
+    stop_at = jobs.parse_time(data.get('stop_at'))
+    start_at = jobs.parse_time(data.get('start_at'), after=stop_at - jobs.DAY if stop_at else None)
+    return jobs.Job(settings, count, tag=data.get('tag') or None, start_at=start_at, stop_at=stop_at,
+                    daily=bool(data.get('daily', False)))
+
+
+def parse_settings(data: dict, settings: dict) -> dict:
+    """``settings`` updated with the values of a request, all numbers but the FITS compression."""
+    settings = dict(settings)
+    for key, value in data.items():
+        if key not in SETTING_KEYS:
+            raise ValueError(f"Unknown setting {key}")
+        if key == 'compression':
+            if value not in camera.FITS_COMPRESSION:
+                raise ValueError(f"Unknown FITS compression {value}")
+            settings[key] = value
+        else:
+            settings[key] = int(value)
+    return settings
+
+
+def publish_progress() -> None:
+    capture_pipeline = internal_states['pipeline']
+    queue_status = capture_pipeline.status() if capture_pipeline else None
+    job = job_manager.current()
+    event_broadcaster.publish('progress', {'eta': job.eta if job else "", 'job': job.id if job else None,
+                                           'exposure': cam.exposure_progress() if cam else None,
+                                           'queue': queue_status})
 
 # def start_scheduler_thread(count: int):
 #     global scheduler, terminate_scheduler, cam, settings, image_specs, scheduler_running
@@ -546,7 +1044,6 @@ def create_task(repeat: int) -> Response:
 #                 name = name.replace("\\", "/")
 #             info["timestamp"] = time_stamp
 #             cam.array_to_fits(array, name, info)
-#             cam.array_to_png(array, name)
 #             image_specs[f"{time_stamp}.png"] = {
 #                 "timestamp": time_stamp, "exposure": exposure, "gain": gain, "offset": offset
 #             }
@@ -659,94 +1156,165 @@ def create_task(repeat: int) -> Response:
 #     print("Specs saved")
 
 
-def scan_images() -> list[str]:
+def scan_images() -> Sequence[str]:
+    # the catalog keeps the listing of the image directory, no need to list it again
+    return image_catalog.names()
+
+
+def preview_file(name: str) -> Optional[str]:
+    """Path of the preview image of a frame relative to the image directory, None if it has none."""
     img_dir = os.path.join(PROJECT_PATH, "shared", "img")
-    return [
-        f.rstrip('.png')
-        for f in os.listdir(img_dir)
-        if f.endswith('.png')
-    ]
+    for ext in (preview_encoder.ext, *stretch.PREVIEW_EXTENSIONS):
+        if os.path.exists(layout.frame_path(img_dir, name, ext)):
+            return layout.relative_path(name, ext)
+    return None
 
 
-def restore_png():
+def index_entry(img: str, spec: Optional[dict], tag: str) -> tuple:
     img_dir = os.path.join(PROJECT_PATH, "shared", "img")
-    fits_images = [f for f in os.listdir(img_dir) if f.endswith('.fits')]
-    for fits in fits_images:
-        png_path = os.path.join(img_dir, fits.replace('.fits', '.png'))
-        if os.path.exists(png_path):
-            continue
-        camera.Camera.fits_to_png(os.path.join(img_dir, fits))
-        print(f"Restored {fits} to {png_path}")
-
-
-def read_fits_header(filename):
-    with fits.open(filename) as hdul:
-        header = hdul[0].header
-        try:
-            tag = header["TAG"]
-        except KeyError:
-            tag = 'none'
-        except Exception:
-            tag = 'none'
-        try:
-            res = {
-                "exposure": header["EXPTIME"],
-                "gain": header["EGAIN"],
-                "offset": header["OFFSET"],
-                "timestamp": header["DATE-OBS"],
-                "tag": tag
-            }
-
-        except KeyError:
-            res =  {
-                "exposure": "unknown",
-                "gain": "unknown",
-                "offset": "unknown",
-                "timestamp": "unknown",
-                "tag": tag
-            }
-        return res
-
-
-def load_specs():
-    existing_files = scan_images()
-    for img in existing_files:
-        file_path = os.path.join(PROJECT_PATH, "shared", "img", f"{img}.fits")
-        fits_header = read_fits_header(file_path)
-        exp = int(float(fits_header["exposure"]) * 1e6)
-        gain = int(fits_header["gain"])
-        offset = int(fits_header["offset"])
-        tstamp = fits_header["timestamp"]
-        tag = fits_header['tag']
-        image_specs[img] = {"timestamp": tstamp, "exposure": exp, "gain": gain, "offset": offset}
-        if tag != "none":
-            if tags.get(tag):
-                tags[tag].append(img)
-            else:
-                tags[tag] = [img]
+    fits_stat = os.stat(layout.frame_path(img_dir, img, ".fits"))
+    preview = preview_file(img)
+    png_size = os.path.getsize(os.path.join(img_dir, preview)) if preview is not None else 0
+    return img, spec or {}, tag, fits_stat.st_size, png_size, fits_stat.st_mtime
+
+
+def spec_from_header(fits_header: dict) -> Optional[dict]:
+    try:
+        return {
+            "timestamp": fits_header["timestamp"],
+            "exposure": int(float(fits_header["exposure"]) * 1e6),
+            "gain": int(fits_header["gain"]),
+            "offset": int(fits_header["offset"]),
+        }
+    except ValueError:
+        # the header does not carry the capture settings
+        return None
+
+
+def load_specs() -> list[tuple[str, str, bool]]:
+    """
+    Load the metadata index without opening any FITS file.
+
+    Returns the frames for the startup recovery: (name, FITS path, preview missing) of
+    the frames that are new, were modified since they were indexed or lost their preview.
+    """
+    img_dir = os.path.join(PROJECT_PATH, "shared", "img")
+    fits_files, previews = {}, set()
+    for _, partition_dir in layout.partitions(img_dir):
+        with os.scandir(partition_dir) as entries:
+            for entry in entries:
+                name, ext = os.path.splitext(entry.name)
+                if ext == '.fits':
+                    fits_files[name] = (entry.path, entry.stat().st_mtime)
+                elif ext in stretch.PREVIEW_EXTENSIONS:
+                    previews.add(name)
+
+    indexed = metadata_index.load()
+    stale = [img for img in indexed if img not in fits_files and img not in previews]
+    metadata_index.remove(stale)
+
+    recover = []
+    for img, (path, mtime) in fits_files.items():
+        row = indexed.get(img)
+        current = row is not None and row["mtime"] == mtime
+        if not current or img not in previews:
+            recover.append((img, path, img not in previews))
+        if not current:
+            indexed.pop(img, None)
+    for img in stale:
+        del indexed[img]
+    counts = metadata_index.detection_counts()
+    with frames_lock:
+        for img, row in indexed.items():
+            if row.get("exposure") is not None:
+                image_specs[img] = {field: row[field] for field in ("timestamp", "exposure", "gain", "offset")}
+                image_specs[img]["meteors"] = counts.get(img, 0)
+    tag_index.load(metadata_index.load_tags())
+    print(f"Metadata index loaded: {len(indexed)} images, {len(recover)} to recover, {len(stale)} removed")
+    return recover
+
+
+def frames_recovered(results: list[tuple[str, dict, Optional[str]]]) -> None:
+    # runs on the startup recovery thread with a batch of frames read by the worker processes
+    before = metadata_index.total_size()
+    counts = metadata_index.detection_counts()
+    entries, specs = [], {}
+    for img, fields, preview_path in results:
+        spec = spec_from_header(fields)
+        entries.append(index_entry(img, spec, fields['tag']))
+        if spec is not None:
+            spec["meteors"] = counts.get(img, 0)
+            specs[img] = spec
+    metadata_index.upsert_many(entries)
+    with frames_lock:
+        image_specs.update(specs)
+        for img, fields, preview_path in results:
+            if fields['tag'] != 'none':
+                tag_index.add([img], fields['tag'])
+            if preview_path is not None:
+                image_catalog.add(img)
+    delta = metadata_index.total_size() - before
+    if delta > 0:
+        retention_manager.added(delta)
+    else:
+        retention_manager.removed(-delta)
+
+
+@app.route('/get_startup_status')
+def get_startup_status():
+    return jsonify(startup_recovery.status())
 
 
 if __name__ == '__main__':
     EMULATE = True
-    tags, image_specs = {}, {}
+    tag_index, image_specs = tagindex.TagIndex(), {}
+    moved = layout.migrate(os.path.join(PROJECT_PATH, "shared", "img"))
+    if moved:
+        print(f"Moved {moved} files of the flat image directory into date partitions")
+    image_catalog = catalog.ImageCatalog(os.path.join(PROJECT_PATH, "shared", "img"),
+                                         extensions=stretch.PREVIEW_EXTENSIONS)
+    thumbnail_store = thumbnails.ThumbnailStore(os.path.join(PROJECT_PATH, "shared", "img"),
+                                                os.path.join(PROJECT_PATH, "shared", "thumbnails"),
+                                                THUMBNAIL_CACHE_SIZE, extensions=stretch.PREVIEW_EXTENSIONS)
     internal_states = {
-        'settings': {'gain': 150, 'offset': 0, 'exposure': 100000, 'interval': 0},
+        'settings': {'gain': 150, 'offset': 0, 'exposure': 100000, 'interval': 0, 'live': 0, 'compression': 'none',
+                     'calibrate': 0, 'hot_pixels': 0, 'meteors': 0},
         'current_tag': None,
         'displaying_list': scan_images(),
-        'eta': "",
+        'pipeline': None,
+        'camera': {'state': 'connecting', 'error': None, 'seconds': None},
     }
-    restore_png()
-
     cam: Optional[camera.Camera] = None
-    load_specs()
+    job_manager: Optional[jobs.JobManager] = None
+    metadata_index = metadata.MetadataIndex(os.path.join(PROJECT_PATH, "shared", "index.sqlite"))
+    calibration_library = calibration.CalibrationLibrary(os.path.join(PROJECT_PATH, "shared", "calibration"))
+    hot_pixels = hotpixels.HotPixels(os.path.join(PROJECT_PATH, "shared", "calibration", "hot_pixels.npz"))
+    frames_to_recover = load_specs()
+    retention_manager = retention.RetentionManager(metadata_index, remove_frames,
+                                                   os.path.join(PROJECT_PATH, "shared", "img"),
+                                                   RETENTION_MAX_BYTES, RETENTION_MAX_AGE, RETENTION_KEEP_TAGGED,
+                                                   MIN_FREE_BYTES)
+    # headers and missing previews are read by a process pool while the server is already up,
+    # the pool is forked first so that no other thread is running yet
+    startup_recovery = recovery.StartupRecovery(preview_encoder, frames_recovered)
+    startup_recovery.start(frames_to_recover)
+    image_catalog.start()
+    Thread(target=watch_resources, daemon=True).start()
+    retention_manager.start()
 
     try:
-        cam = camera.Camera(PROJECT_PATH, EMULATE)
+        # capture jobs wait for camera_ready, everything else is served right away
+        Thread(target=connect_camera, daemon=True).start()
+        job_manager = jobs.JobManager(run_capture, on_change=job_changed)
         settings = {'gain': 150, 'offset': 0, 'exposure': 100000, 'interval': 0}
-        app.run(host='0.0.0.0', port=8080)
+        app.run(host='0.0.0.0', port=SERVER_PORT)
     finally:
-        if scheduler is not None:
-            terminate_scheduler.set()
-            scheduler.join()
-        cam.close()
+        if job_manager is not None:
+            job_manager.shutdown()
+        startup_recovery.stop()
+        retention_manager.stop()
+        if cam is not None:
+            cam.close()
+        metadata_index.close()
+        image_catalog.stop()
         print("Server closed")